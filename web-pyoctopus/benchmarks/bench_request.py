@@ -0,0 +1,77 @@
+"""
+# Request Allocation Benchmark
+
+Counts the allocations (tracemalloc) a small GET request keeps alive while
+it is being handled: the request object plus whatever it parsed and cached
+for the path, method and one query parameter, which is all routing and a
+typical small endpoint touch. Compares the framework's lazy `Request` with
+`webob.Request`.
+
+    python benchmarks/bench_request.py
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webob import Request as WebObRequest  # noqa: E402
+
+from web_pyoctopus.request import Request  # noqa: E402
+
+
+REQUESTS = 10000
+
+
+def make_environ():
+    return {
+        "REQUEST_METHOD": "GET",
+        "SCRIPT_NAME": "",
+        "PATH_INFO": "/books/42",
+        "QUERY_STRING": "page=2",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "HTTP_HOST": "localhost",
+        "HTTP_ACCEPT": "application/json",
+        "wsgi.url_scheme": "http",
+    }
+
+
+def handle_webob(environ):
+    request = WebObRequest(environ)
+    return request, request.path, request.method, request.GET.get("page")
+
+
+def handle_lazy(environ):
+    request = Request(environ)
+    return request, request.path, request.method, request.query.get("page")
+
+
+def measure(handle):
+    environs = [make_environ() for _ in range(REQUESTS)]
+    results = []
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for environ in environs:
+        results.append(handle(environ))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+
+    return blocks / REQUESTS, size / REQUESTS
+
+
+def main():
+    print(f"{'request':>8} {'blocks/req':>11} {'bytes/req':>10}")
+    for label, handle in (("webob", handle_webob), ("lazy", handle_lazy)):
+        blocks, size = measure(handle)
+        print(f"{label:>8} {blocks:>11.1f} {size:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
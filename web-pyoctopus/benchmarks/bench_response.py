@@ -0,0 +1,64 @@
+"""
+# Response Emission Benchmark
+
+Compares responses/sec of the lean WSGI writer in `Response.__call__` with
+the WebOb path (`Response.to_webob()`) for the text, json and html helpers.
+
+    python benchmarks/bench_response.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_pyoctopus.response import Response  # noqa: E402
+
+
+CALLS = 50000
+
+ENVIRON = {
+    "REQUEST_METHOD": "GET",
+    "PATH_INFO": "/",
+    "SERVER_NAME": "localhost",
+    "SERVER_PORT": "80",
+    "wsgi.url_scheme": "http",
+}
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def make_response(helper):
+    response = Response()
+
+    if helper == "text":
+        response.text = "Hello from the HOME page"
+    elif helper == "json":
+        response.json = {"name": "Octopus", "arms": 8, "tags": ["fast", "small"]}
+    elif helper == "html":
+        response.html = "<html><body><h1>Octopus</h1></body></html>"
+
+    return response
+
+
+def lean(helper):
+    b"".join(make_response(helper)(ENVIRON, start_response))
+
+
+def webob(helper):
+    b"".join(make_response(helper).to_webob()(ENVIRON, start_response))
+
+
+def main():
+    print(f"{'helper':>8} {'webob req/s':>12} {'lean req/s':>12} {'speedup':>8}")
+    for helper in ("text", "json", "html"):
+        before = CALLS / timeit.timeit(lambda: webob(helper), number=CALLS)
+        after = CALLS / timeit.timeit(lambda: lean(helper), number=CALLS)
+        print(f"{helper:>8} {before:>12.0f} {after:>12.0f} {after / before:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
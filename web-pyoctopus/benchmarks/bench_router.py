@@ -0,0 +1,67 @@
+"""
+# Route Lookup Benchmark
+
+Times `OctopusAPI.find_handler` for a static hit, a parameterised hit and a
+miss while the route table grows from 10 to 10,000 templates. With the
+segment trie the numbers should stay flat.
+
+    python benchmarks/bench_router.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_pyoctopus.api import OctopusAPI  # noqa: E402
+
+
+ROUTE_COUNTS = [10, 100, 1000, 10000]
+LOOKUPS = 20000
+
+
+def handler(req, resp):
+    resp.text = "ok"
+
+
+def build_app(route_count):
+    app = OctopusAPI()
+
+    for i in range(route_count // 2):
+        app.add_route(f"/static{i}/page", handler)
+        app.add_route(f"/items{i}/{{item_id:d}}/{{name}}", handler)
+
+    return app
+
+
+def bench(route_count):
+    app = build_app(route_count)
+    last = route_count // 2 - 1
+
+    paths = {
+        "static": f"/static{last}/page",
+        "param": f"/items{last}/42/octopus",
+        "miss": "/does/not/exist",
+    }
+
+    results = {}
+    for label, path in paths.items():
+        seconds = timeit.timeit(lambda: app.find_handler(path), number=LOOKUPS)
+        results[label] = seconds / LOOKUPS * 1e6
+
+    return results
+
+
+def main():
+    print(f"{'routes':>8} {'static us':>10} {'param us':>10} {'miss us':>10}")
+    for route_count in ROUTE_COUNTS:
+        results = bench(route_count)
+        print(
+            f"{route_count:>8} {results['static']:>10.2f} "
+            f"{results['param']:>10.2f} {results['miss']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+# Import-Time Budget
+
+Imports `web_pyoctopus.api` in a fresh interpreter under `python -X importtime`
+and fails when the cumulative import time exceeds the budget, or when a module
+that should only load on first use (Jinja, WhiteNoise, WebOb, requests,
+asyncio, ...) is imported eagerly:
+
+    python benchmarks/import_budget.py --budget-ms 80
+    python benchmarks/import_budget.py --top 20
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# loaded only by the subsystems that need them
+LAZY_MODULES = (
+    "asyncio",
+    "concurrent.futures",
+    "cProfile",
+    "jinja2",
+    "requests",
+    "webob",
+    "whitenoise",
+    "wsgiadapter",
+)
+
+
+def import_times(module="web_pyoctopus.api", rounds=5):
+    """
+    Returns {module: (self us, cumulative us)} from the fastest of `rounds`
+    fresh interpreters, so a cold disk cache doesn't count against the budget.
+    """
+
+    best = None
+
+    for _ in range(rounds):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            own, cumulative, name = line[len("import time:") :].split("|")
+            if own.strip().isdigit():
+                times[name.strip()] = (int(own), int(cumulative))
+
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+
+    return best
+
+
+def eager_modules(times):
+    return sorted(
+        name
+        for name in times
+        if any(name == lazy or name.startswith(f"{lazy}.") for lazy in LAZY_MODULES)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default="web_pyoctopus.api")
+    parser.add_argument("--budget-ms", type=float, default=80.0)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    times = import_times(args.module)
+    total_ms = times[args.module][1] / 1000
+
+    print(f"{args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.1f} ms)")
+    for name, (own, _) in sorted(times.items(), key=lambda item: -item[1][0])[
+        : args.top
+    ]:
+        print(f"  {own / 1000:>7.2f} ms  {name}")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import took {total_ms:.1f} ms")
+    eager = eager_modules(times)
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
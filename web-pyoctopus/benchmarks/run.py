@@ -0,0 +1,233 @@
+"""
+# Benchmark Suite
+
+Drives the WSGI callable directly (no server, no network) through:
+
+- route-count scaling: static, parameterised and missing paths, 10-10,000 routes
+- middleware depth: 0-20 layers, with no-op hooks and with no hooks at all
+- class-based vs function handlers
+- text, json and html responses
+- static files
+
+Each benchmark reports the best of several rounds. Results can be written
+as JSON and compared with an earlier run:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --compare results.json
+    python benchmarks/run.py --filter middleware --quick
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_pyoctopus.api import OctopusAPI  # noqa: E402
+from web_pyoctopus.middleware import Middleware  # noqa: E402
+from web_pyoctopus.testing import make_environ  # noqa: E402
+
+
+ROUTE_COUNTS = (10, 100, 1000, 10000)
+MIDDLEWARE_DEPTHS = (0, 1, 5, 10, 20)
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def text_handler(req, resp):
+    resp.text = "Hello from the HOME page"
+
+
+def param_handler(req, resp, item_id, name):
+    resp.text = name
+
+
+class NoOpMiddleware(Middleware):
+    def process_request(self, req):
+        pass
+
+    def process_response(self, req, resp):
+        pass
+
+
+class PassThroughMiddleware(Middleware):
+    pass
+
+
+class BookResource:
+    def get(self, req, resp):
+        resp.text = "Books Page"
+
+
+def build_routes_app(route_count):
+    app = OctopusAPI()
+    for i in range(route_count // 2):
+        app.add_route(f"/static{i}/page", text_handler)
+        app.add_route(f"/items{i}/{{item_id:d}}/{{name}}", param_handler)
+    return app
+
+
+def routing_benchmarks():
+    for route_count in ROUTE_COUNTS:
+        app = build_routes_app(route_count)
+        last = route_count // 2 - 1
+        paths = {
+            "static": f"/static{last}/page",
+            "param": f"/items{last}/42/octopus",
+            "miss": "/does/not/exist",
+        }
+        for kind, path in paths.items():
+            yield f"routing.{kind}.{route_count}", app, make_environ(path=path)
+
+
+def middleware_benchmarks():
+    for depth in MIDDLEWARE_DEPTHS:
+        app = OctopusAPI()
+        app.add_route("/home", text_handler)
+        for _ in range(depth):
+            app.add_middleware(NoOpMiddleware)
+        yield f"middleware.{depth}", app, make_environ(path="/home")
+
+        app = OctopusAPI()
+        app.add_route("/home", text_handler)
+        for _ in range(depth):
+            app.add_middleware(PassThroughMiddleware)
+        yield f"middleware.passthrough.{depth}", app, make_environ(path="/home")
+
+
+def handler_benchmarks():
+    app = OctopusAPI()
+    app.add_route("/function", text_handler)
+    app.add_route("/class", BookResource)
+    app.add_route("/class-process", BookResource, lifecycle="process")
+
+    yield "handler.function", app, make_environ(path="/function")
+    yield "handler.class", app, make_environ(path="/class")
+    yield "handler.class_process", app, make_environ(path="/class-process")
+
+
+def response_benchmarks():
+    def json_handler(req, resp):
+        resp.json = {"name": "Octopus", "arms": 8, "tags": ["fast", "small"]}
+
+    def html_handler(req, resp):
+        resp.html = "<html><body><h1>Octopus</h1></body></html>"
+
+    app = OctopusAPI()
+    app.add_route("/text", text_handler)
+    app.add_route("/json", json_handler)
+    app.add_route("/html", html_handler)
+
+    for kind in ("text", "json", "html"):
+        yield f"response.{kind}", app, make_environ(path=f"/{kind}")
+
+
+def static_benchmarks():
+    static_dir = tempfile.mkdtemp(prefix="octopus-bench-")
+    with open(os.path.join(static_dir, "main.css"), "w") as f:
+        f.write("body {background-color: red}\n" * 100)
+
+    app = OctopusAPI(static_dir=static_dir)
+    yield "static.file", app, make_environ(path="/static/main.css")
+
+    app = OctopusAPI(static_dir=static_dir)
+    app.enable_static_files(precompress=True)
+    yield "static.cached", app, make_environ(path="/static/main.css")
+    yield "static.gzip", app, make_environ(
+        path="/static/main.css", headers={"Accept-Encoding": "gzip, br"}
+    )
+
+
+GROUPS = (
+    routing_benchmarks,
+    middleware_benchmarks,
+    handler_benchmarks,
+    response_benchmarks,
+    static_benchmarks,
+)
+
+
+def measure(app, environ, number, rounds):
+    def call():
+        body = app(dict(environ), start_response)
+        for _ in body:
+            pass
+        if hasattr(body, "close"):
+            body.close()
+
+    call()
+    best = min(timeit.repeat(call, number=number, repeat=rounds)) / number
+
+    return {"us_per_call": best * 1e6, "calls_per_sec": 1 / best}
+
+
+def run(name_filter=None, number=2000, rounds=5):
+    results = {}
+
+    for group in GROUPS:
+        for name, app, environ in group():
+            if name_filter and name_filter not in name:
+                continue
+            results[name] = measure(app, environ, number, rounds)
+            print(
+                f"{name:<28} {results[name]['us_per_call']:>10.2f} us "
+                f"{results[name]['calls_per_sec']:>12.0f} /s"
+            )
+
+    return results
+
+
+def compare(results, baseline):
+    print()
+    print(f"{'benchmark':<28} {'before us':>10} {'after us':>10} {'change':>8}")
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        change = result["us_per_call"] / before["us_per_call"] - 1
+        print(
+            f"{name:<28} {before['us_per_call']:>10.2f} "
+            f"{result['us_per_call']:>10.2f} {change:>+8.1%}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="compare with an earlier JSON result")
+    parser.add_argument("--filter", help="only run benchmarks containing this")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations")
+    args = parser.parse_args(argv)
+
+    number, rounds = (200, 3) if args.quick else (2000, 5)
+    results = run(args.filter, number=number, rounds=rounds)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.output:
+        document = {
+            "meta": {
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "platform": platform.platform(),
+                "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "number": number,
+                "rounds": rounds,
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
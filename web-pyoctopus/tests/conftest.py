@@ -10,4 +10,4 @@ def api():
 
 @pytest.fixture
 def client(api):
-    return api.test_session()
+    return api.test_client()
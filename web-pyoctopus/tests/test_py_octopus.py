@@ -2,6 +2,9 @@
 # Test Py-Octopus apis
 """
 
+import json
+import os
+
 import pytest
 from web_pyoctopus.api import OctopusAPI
 
@@ -79,8 +82,10 @@ def test_class_based_handler_not_allowed_method(api, client):
         def post(self, req, resp):
             resp.text = "Wow"
 
-    with pytest.raises(AttributeError):
-        client.get("http://testserver/book")
+    response = client.get("http://testserver/book")
+
+    assert response.status_code == 405
+    assert response.headers["Allow"] == "POST"
 
 
 def test_alternative_route(api, client):
@@ -207,8 +212,10 @@ def test_allowed_method_for_function_based_handler(api, client):
     def home(req, resp):
         resp.text = "Hello"
 
-    with pytest.raises(AttributeError):
-        client.get("http://testserver/home")
+    response = client.get("http://testserver/home")
+
+    assert response.status_code == 405
+    assert response.headers["Allow"] == "POST"
 
     assert client.post("http://testserver/home").text == "Hello"
 
@@ -259,3 +266,2016 @@ def test_manually_setting_body(api, client):
 
     assert "text/plain" in response.headers["Content-Type"]
     assert response.text == "Byte Body"
+
+
+"""
+# Test Code for the Route Trie
+
+"""
+
+
+def test_typed_parameterized_route(api, client):
+    @api.route("/add/{a:d}/{b:d}")
+    def add(req, resp, a, b):
+        resp.text = str(a + b)
+
+    assert client.get("http://testserver/add/2/3").text == "5"
+    assert client.get("http://testserver/add/2/three").status_code == 404
+
+
+def test_static_route_wins_over_parameterized_route(api, client):
+    @api.route("/home/{name}")
+    def greeting(req, resp, name):
+        resp.text = f"hello, {name}"
+
+    @api.route("/home/about")
+    def about(req, resp):
+        resp.text = "about"
+
+    assert client.get("http://testserver/home/about").text == "about"
+    assert client.get("http://testserver/home/octopus").text == "hello, octopus"
+
+
+def test_route_matching_backtracks_to_parameterized_branch(api, client):
+    @api.route("/files/latest/info")
+    def latest(req, resp):
+        resp.text = "latest"
+
+    @api.route("/files/{name}/raw")
+    def raw(req, resp, name):
+        resp.text = f"raw {name}"
+
+    assert client.get("http://testserver/files/latest/raw").text == "raw latest"
+    assert client.get("http://testserver/files/latest/nope").status_code == 404
+
+
+def test_routes_are_case_sensitive(api, client):
+    @api.route("/home")
+    def home(req, resp):
+        resp.text = "home"
+
+    @api.route("/users/{id:d}/Profile")
+    def profile(req, resp, id):
+        resp.text = f"profile {id}"
+
+    assert client.get("http://testserver/home").text == "home"
+    assert client.get("http://testserver/HOME").status_code == 404
+    assert client.get("http://testserver/users/1/Profile").text == "profile 1"
+    assert client.get("http://testserver/users/1/profile").status_code == 404
+
+
+def test_static_routes_take_the_fast_path(api, client):
+    @api.route("/about")
+    def about(req, resp):
+        resp.text = "about"
+
+    @api.route("/users/{name}")
+    def user(req, resp, name):
+        resp.text = name
+
+    client.get("http://testserver/about")
+    client.get("http://testserver/users/octopus")
+
+    assert api.router.stats["static_hits"] == 1
+    assert api.router.stats["dynamic_hits"] == 1
+
+
+def test_repeated_404s_are_served_from_the_miss_cache(api, client):
+    for _ in range(3):
+        assert client.get("http://testserver/favicon.ico").status_code == 404
+
+    assert api.router.stats["misses"] == 1
+    assert api.router.stats["cached_misses"] == 2
+
+    @api.route("/favicon.ico")
+    def favicon(req, resp):
+        resp.text = "icon"
+
+    assert client.get("http://testserver/favicon.ico").text == "icon"
+
+
+"""
+# Test Code for ASGI Support
+
+"""
+import asyncio
+
+
+# helpers
+def _asgi_request(app, path, method="GET", body=b"", headers=None):
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"host", b"testserver")]
+        + [
+            (name.lower().encode(), value.encode())
+            for name, value in (headers or {}).items()
+        ],
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app.asgi(scope, receive, send))
+
+    status = sent[0]["status"]
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return status, body
+
+
+# tests
+def test_asgi_async_function_handler(api):
+    @api.route("/hello/{name}")
+    async def hello(req, resp, name):
+        await asyncio.sleep(0)
+        resp.text = f"hello, {name}"
+
+    assert _asgi_request(api, "/hello/octopus") == (200, b"hello, octopus")
+
+
+def test_asgi_sync_and_class_based_handlers(api):
+    @api.route("/sync")
+    def sync_handler(req, resp):
+        resp.text = "sync"
+
+    @api.route("/book")
+    class BookResource:
+        async def post(self, req, resp):
+            resp.text = req.body.decode()
+
+    assert _asgi_request(api, "/sync") == (200, b"sync")
+    assert _asgi_request(api, "/book", "POST", b"a book") == (200, b"a book")
+    assert _asgi_request(api, "/missing")[0] == 404
+
+
+def test_asgi_runs_middleware_and_exception_handler(api):
+    calls = []
+
+    class RecordingMiddleware(Middleware):
+        def process_request(self, req):
+            calls.append("request")
+
+        def process_response(self, req, resp):
+            calls.append("response")
+
+    api.add_middleware(RecordingMiddleware)
+    api.add_exception_handler(lambda req, resp, exc: setattr(resp, "text", "handled"))
+
+    @api.route("/boom")
+    async def boom(req, resp):
+        raise ValueError
+
+    assert _asgi_request(api, "/boom") == (200, b"handled")
+    assert calls == ["request", "response"]
+
+
+def test_async_handler_is_served_over_wsgi(api, client):
+    @api.route("/async")
+    async def handler(req, resp):
+        resp.text = "async over wsgi"
+
+    assert client.get("http://testserver/async").text == "async over wsgi"
+
+
+"""
+# Test Code for Streaming Responses
+
+"""
+
+
+def test_generator_is_streamed_without_buffering(api, client):
+    produced = []
+
+    def rows():
+        for i in range(3):
+            produced.append(i)
+            yield f"row {i}\n"
+
+    @api.route("/export")
+    def export(req, resp):
+        resp.content_type = "text/csv"
+        resp.stream = rows()
+
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": "/export",
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "wsgi.url_scheme": "http",
+    }
+    body = api(environ, lambda status, headers: None)
+
+    assert produced == []
+    assert b"".join(body) == b"row 0\nrow 1\nrow 2\n"
+    assert client.get("http://testserver/export").headers["Content-Type"].startswith(
+        "text/csv"
+    )
+
+
+def test_file_stream_uses_wsgi_file_wrapper(api, tmpdir):
+    export = tmpdir.join("export.csv")
+    export.write("a,b\n1,2\n")
+    wrapped = []
+
+    def file_wrapper(file, block_size):
+        wrapped.append(file)
+        return iter(lambda: file.read(block_size), b"")
+
+    @api.route("/export")
+    def handler(req, resp):
+        resp.stream = open(str(export), "rb")
+
+    headers = {}
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": "/export",
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "wsgi.url_scheme": "http",
+        "wsgi.file_wrapper": file_wrapper,
+    }
+    body = api(environ, lambda status, headerlist: headers.update(headerlist))
+
+    assert b"".join(body) == b"a,b\n1,2\n"
+    assert len(wrapped) == 1
+    assert headers["Content-Length"] == "8"
+    wrapped[0].close()
+
+
+def test_asgi_streams_async_generators(api):
+    async def chunks():
+        for word in ("stream", "ing"):
+            yield word
+
+    @api.route("/stream")
+    async def handler(req, resp):
+        resp.stream = chunks()
+
+    assert _asgi_request(api, "/stream") == (200, b"streaming")
+
+
+"""
+# Test Code for the Lean Response Writer
+
+"""
+
+
+def test_custom_headers_and_status(api, client):
+    @api.route("/created")
+    def created(req, resp):
+        resp.status_code = 201
+        resp.headers["Location"] = "/books/1"
+        resp.json = {"id": 1}
+
+    response = client.get("http://testserver/created")
+
+    assert response.status_code == 201
+    assert response.headers["Location"] == "/books/1"
+    assert response.headers["Content-Length"] == str(len(response.content))
+
+
+def test_no_content_response_has_no_body(api, client):
+    @api.route("/empty")
+    def empty(req, resp):
+        resp.status_code = 204
+        resp.text = "ignored"
+
+    response = client.get("http://testserver/empty")
+
+    assert response.status_code == 204
+    assert response.content == b""
+
+
+def test_webob_response_opt_in(api, client):
+    from webob import Response as WebObResponse
+
+    @api.route("/webob")
+    def handler(req, resp):
+        resp.webob = WebObResponse(text="from webob")
+        resp.webob.set_cookie("flavour", "ink")
+
+    response = client.get("http://testserver/webob")
+
+    assert response.text == "from webob"
+    assert response.cookies["flavour"] == "ink"
+
+
+"""
+# Test Code for JSON Serialisation
+
+"""
+import dataclasses
+import datetime
+
+
+@pytest.mark.parametrize("backend", [None, "stdlib"])
+def test_json_handles_datetimes_and_dataclasses(backend):
+    @dataclasses.dataclass
+    class Book:
+        title: str
+        published: datetime.date
+
+    api = OctopusAPI(json_backend=backend)
+    client = api.test_session()
+
+    @api.route("/book")
+    def book(req, resp):
+        resp.json = {"book": Book("Octopus", datetime.date(2024, 1, 2))}
+
+    response = client.get("http://testserver/book")
+
+    assert response.json() == {"book": {"title": "Octopus", "published": "2024-01-02"}}
+
+
+def test_custom_json_default_encoder():
+    class Point:
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    def encode_point(obj):
+        if isinstance(obj, Point):
+            return [obj.x, obj.y]
+        raise TypeError
+
+    api = OctopusAPI(json_backend="stdlib", json_default=encode_point)
+    client = api.test_session()
+
+    @api.route("/point")
+    def point(req, resp):
+        resp.json = {"point": Point(1, 2), "at": datetime.time(10, 30)}
+
+    assert client.get("http://testserver/point").json() == {
+        "point": [1, 2],
+        "at": "10:30:00",
+    }
+
+
+def test_pre_encoded_json_is_sent_as_is(api, client):
+    @api.route("/cached")
+    def cached(req, resp):
+        resp.json = b'{"cached": true}'
+
+    response = client.get("http://testserver/cached")
+
+    assert response.content == b'{"cached": true}'
+    assert response.headers["Content-Type"] == "application/json"
+
+
+@pytest.mark.parametrize("backend", [None, "stdlib"])
+def test_json_accepts_non_string_keys(backend):
+    api = OctopusAPI(json_backend=backend)
+
+    assert json.loads(api.json_dumps({1: "a", 2.5: "b", False: "c", None: "d"})) == {
+        "1": "a",
+        "2.5": "b",
+        "false": "c",
+        "null": "d",
+    }
+
+
+def test_unknown_json_backend_is_rejected():
+    with pytest.raises(ValueError):
+        OctopusAPI(json_backend="pickle")
+
+
+"""
+# Test Code for the Request Object
+
+"""
+from web_pyoctopus.request import Request
+
+
+def test_request_parses_lazily_and_caches(api, client):
+    seen = {}
+
+    @api.route("/books/{book_id:d}")
+    def book(req, resp, book_id):
+        seen["query"] = req.query
+        seen["agent"] = req.headers["user-agent"]
+        seen["cookies"] = req.cookies
+        seen["body"] = (req.body, req.body, req.json)
+        resp.text = req.path
+
+    response = client.post(
+        "http://testserver/books/7?page=2&sort=title",
+        json={"title": "Octopus"},
+        headers={"User-Agent": "tests", "Cookie": "flavour=ink"},
+    )
+
+    assert response.text == "/books/7"
+    assert seen["query"] == {"page": "2", "sort": "title"}
+    assert seen["agent"] == "tests"
+    assert seen["cookies"] == {"flavour": "ink"}
+    assert seen["body"] == (b'{"title": "Octopus"}',) * 2 + ({"title": "Octopus"},)
+
+
+def test_request_defers_to_webob_for_everything_else():
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": "/search",
+        "QUERY_STRING": "q=octopus",
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "HTTP_ACCEPT": "text/html",
+        "wsgi.url_scheme": "http",
+    }
+    request = Request(environ)
+    request.user = "octopus"
+
+    assert request.url == "http://testserver/search?q=octopus"
+    assert request.GET["q"] == "octopus"
+    assert request.user == "octopus"
+    assert request.webob.user == "octopus"
+    assert not hasattr(request, "__dict__")
+
+
+"""
+# Test Code for Class-Based Resource Lifecycles
+
+"""
+import threading
+
+
+@pytest.mark.parametrize(
+    "lifecycle, expected_instances", [("request", 3), ("thread", 1), ("process", 1)]
+)
+def test_resource_lifecycle(api, client, lifecycle, expected_instances):
+    instances = []
+
+    @api.route("/book", lifecycle=lifecycle)
+    class BookResource:
+        def __init__(self):
+            instances.append(self)
+
+        def get(self, req, resp):
+            resp.text = "get"
+
+        def post(self, req, resp):
+            resp.text = "post"
+
+    for method in ("get", "post", "get"):
+        assert client.request(method, "http://testserver/book").text == method
+
+    assert len(instances) == expected_instances
+
+
+def test_thread_lifecycle_creates_one_instance_per_thread(api, client):
+    instances = []
+
+    @api.route("/book", lifecycle="thread")
+    class BookResource:
+        def __init__(self):
+            instances.append(self)
+
+        def get(self, req, resp):
+            resp.text = "get"
+
+    thread = threading.Thread(target=client.get, args=("http://testserver/book",))
+    thread.start()
+    thread.join()
+    client.get("http://testserver/book")
+    client.get("http://testserver/book")
+
+    assert len(instances) == 2
+
+
+def test_unknown_lifecycle_is_rejected(api):
+    with pytest.raises(ValueError):
+
+        @api.route("/book", lifecycle="forever")
+        class BookResource:
+            def get(self, req, resp):
+                pass
+
+
+"""
+# Test Code for the Response Cache
+
+"""
+import time
+
+from web_pyoctopus.cache import CacheMiddleware, FileCache, MemoryCache
+
+
+def test_cached_route_runs_handler_once(api, client):
+    calls = []
+
+    api.add_middleware(CacheMiddleware)
+
+    @api.route("/report", cache_ttl=60)
+    def report(req, resp):
+        calls.append(req.path)
+        resp.json = {"rows": len(calls)}
+
+    @api.route("/live")
+    def live(req, resp):
+        calls.append(req.path)
+        resp.text = "live"
+
+    first = client.get("http://testserver/report")
+    second = client.get("http://testserver/report")
+    client.get("http://testserver/live")
+    client.get("http://testserver/live")
+
+    assert first.json() == second.json() == {"rows": 1}
+    assert second.headers["Content-Type"] == "application/json"
+    assert calls == ["/report", "/live", "/live"]
+
+
+def test_cached_route_answers_if_none_match_with_304(api, client):
+    calls = []
+
+    api.add_middleware(CacheMiddleware)
+
+    @api.route("/report", cache_ttl=60)
+    def report(req, resp):
+        calls.append(req.path)
+        resp.text = "report"
+
+    etag = client.get("http://testserver/report").headers["ETag"]
+    response = client.get(
+        "http://testserver/report", headers={"If-None-Match": f"W/{etag}"}
+    )
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    assert len(calls) == 1
+
+
+def test_cache_keys_on_query_string_and_vary_headers(api, client):
+    api.add_middleware(CacheMiddleware, ttl=60, vary=["Accept-Language"])
+
+    @api.route("/greeting")
+    def greeting(req, resp):
+        resp.text = f"{req.query.get('name')} {req.headers.get('accept-language')}"
+
+    def get(name, language):
+        return client.get(
+            f"http://testserver/greeting?name={name}",
+            headers={"Accept-Language": language},
+        ).text
+
+    assert get("ink", "en") == "ink en"
+    assert get("ink", "bn") == "ink bn"
+    assert get("arm", "en") == "arm en"
+
+
+def test_cache_skips_set_cookie_and_keys_on_method(api, client):
+    api.add_middleware(CacheMiddleware, ttl=60)
+    calls = []
+
+    @api.route("/login")
+    def login(req, resp):
+        calls.append(req.method)
+        resp.text = "welcome"
+        resp.headers["Set-Cookie"] = f"session={len(calls)}"
+
+    @api.route("/report", allowed_methods=["get", "head"])
+    def report(req, resp):
+        calls.append(req.method)
+        resp.text = "report"
+
+    assert client.get("/login").headers["set-cookie"] == "session=1"
+    assert client.get("/login").headers["set-cookie"] == "session=2"
+
+    calls.clear()
+    client.get("/report")
+    client.head("/report")
+    client.get("/report")
+    client.head("/report")
+    assert calls == ["GET", "HEAD"]
+
+
+def test_memory_cache_expires_and_evicts():
+    cache = MemoryCache(max_entries=2)
+
+    cache.set("short", {"body": b"1"}, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("short") is None
+
+    cache.set("a", {"body": b"a"}, ttl=60)
+    cache.set("b", {"body": b"b"}, ttl=60)
+    cache.get("a")
+    cache.set("c", {"body": b"c"}, ttl=60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"body": b"a"}
+    assert cache.get("c") == {"body": b"c"}
+
+
+def test_file_cache_is_shared_between_apps(tmpdir):
+    calls = []
+
+    def build():
+        api = OctopusAPI()
+        api.add_middleware(CacheMiddleware, backend=FileCache(str(tmpdir)))
+
+        @api.route("/report", cache_ttl=60)
+        def report(req, resp):
+            calls.append(1)
+            resp.text = "report"
+
+        return api.test_session()
+
+    assert build().get("http://testserver/report").text == "report"
+    assert build().get("http://testserver/report").text == "report"
+    assert len(calls) == 1
+
+
+"""
+# Test Code for Template Caching
+
+"""
+from web_pyoctopus.__main__ import main as cli
+
+
+def _create_templates(templates_dir):
+    templates_dir.join("index.html").write("<h1>{{ name }}</h1>")
+    templates_dir.mkdir("emails").join("welcome.txt").write("Hi {{ name }}")
+
+
+def test_templates_are_precompiled_into_the_bytecode_cache(tmpdir):
+    templates_dir = tmpdir.mkdir("templates")
+    _create_templates(templates_dir)
+
+    api = OctopusAPI(
+        templates_dir=str(templates_dir),
+        template_cache="memory",
+        auto_reload=False,
+        precompile_templates=True,
+    )
+
+    assert len(api.templates_env.bytecode_cache.buckets) == 2
+    assert api.template("emails/welcome.txt", {"name": "Octopus"}) == "Hi Octopus"
+
+
+def test_cli_compiles_templates_for_workers(tmpdir):
+    templates_dir = tmpdir.mkdir("templates")
+    cache_dir = tmpdir.join("cache")
+    _create_templates(templates_dir)
+
+    cli(["compile-templates", str(templates_dir), str(cache_dir)])
+
+    assert len(cache_dir.listdir()) == 2
+
+    api = OctopusAPI(templates_dir=str(templates_dir), template_cache=str(cache_dir))
+    assert api.template("index.html", {"name": "Octopus"}) == "<h1>Octopus</h1>"
+
+
+def test_template_stream_renders_in_chunks(tmpdir):
+    templates_dir = tmpdir.mkdir("templates")
+    templates_dir.join("report.html").write(
+        "<ul>{% for row in rows %}<li>{{ row }}</li>{% endfor %}</ul>"
+    )
+    rendered = []
+
+    def rows():
+        for i in range(2000):
+            rendered.append(i)
+            yield i
+
+    api = OctopusAPI(templates_dir=str(templates_dir))
+    client = api.test_session()
+
+    chunks = api.template_stream("report.html", {"rows": rows()}, chunk_size=1024)
+    assert rendered == []
+
+    assert 1024 <= len(next(chunks)) < 2048
+    assert len(rendered) < 2000
+
+    @api.route("/report")
+    def report(req, resp):
+        resp.stream = api.template_stream("report.html", {"rows": range(2000)})
+
+    response = client.get("http://testserver/report")
+
+    assert "text/html" in response.headers["Content-Type"]
+    assert response.text == api.template("report.html", {"rows": range(2000)})
+
+
+"""
+# Test Code for Metrics
+
+"""
+
+
+def test_metrics_are_recorded_per_route_template(api, client):
+    api.enable_metrics()
+
+    @api.route("/books/{book_id:d}")
+    def book(req, resp, book_id):
+        resp.text = "book"
+
+    client.get("http://testserver/books/1")
+    client.get("http://testserver/books/2")
+    client.get("http://testserver/nope")
+
+    response = client.get("http://testserver/metrics")
+    text = response.text
+
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert 'octopus_responses_total{route="/books/{book_id:d}",status="200"} 2' in text
+    assert 'octopus_responses_total{route="<unmatched>",status="404"} 1' in text
+    assert "octopus_requests_in_flight 1" in text
+    for phase in ("routing", "middleware", "handler", "serialisation"):
+        assert (
+            'octopus_request_phase_seconds_count{route="/books/{book_id:d}",'
+            f'phase="{phase}"}} 2'
+        ) in text
+
+
+def test_metrics_are_aggregated_across_processes(tmpdir):
+    workers = []
+    for _ in range(2):
+        api = OctopusAPI()
+        api.enable_metrics(directory=str(tmpdir), flush_interval=0)
+
+        @api.route("/home")
+        def home(req, resp):
+            resp.text = "home"
+
+        workers.append(api)
+
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": "/home",
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "wsgi.url_scheme": "http",
+    }
+    workers[0](dict(environ), lambda status, headers: None)
+    # both apps live in this process, so pretend the first one's file came from
+    # another worker
+    tmpdir.join(f"{os.getpid()}.json").move(tmpdir.join("1.json"))
+    workers[1](dict(environ), lambda status, headers: None)
+
+    text = workers[1].metrics.render()
+
+    assert 'octopus_responses_total{route="/home",status="200"} 2' in text
+
+
+def test_metrics_of_dead_workers_drop_gauges_and_are_archived(tmpdir):
+    from web_pyoctopus.metrics import Metrics, mark_process_dead
+
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+
+    dead = Metrics(directory=str(tmpdir))
+    dead.inc("octopus_responses_total", (("route", "/"), ("status", 200)), 5)
+    dead.set_gauge("octopus_requests_in_flight", 3)
+    dead.observe("octopus_request_duration_seconds", 0.01)
+    dead.flush()
+    tmpdir.join(f"{os.getpid()}.json").move(tmpdir.join(f"{exited.pid}.json"))
+
+    metrics = Metrics(directory=str(tmpdir))
+    text = metrics.render()
+    assert 'octopus_responses_total{route="/",status="200"} 5' in text
+    assert "octopus_requests_in_flight" not in text
+
+    mark_process_dead(str(tmpdir), exited.pid)
+    assert not tmpdir.join(f"{exited.pid}.json").check()
+    assert tmpdir.join("archive.json").check()
+
+    text = metrics.render()
+    assert 'octopus_responses_total{route="/",status="200"} 5' in text
+    assert "octopus_request_duration_seconds_count 1" in text
+
+
+def test_metrics_cover_asgi_requests(api):
+    metrics = api.enable_metrics(path=None)
+
+    @api.route("/async")
+    async def handler(req, resp):
+        resp.text = "async"
+
+    _asgi_request(api, "/async")
+
+    assert metrics.counters[
+        ("octopus_responses_total", (("route", "/async"), ("status", 200)))
+    ] == 1
+
+
+"""
+# Test Code for Profiling
+
+"""
+import pstats
+
+
+def test_sampled_requests_are_written_as_pstats(api, client, tmpdir):
+    api.enable_profiling(str(tmpdir), sample_rate=1)
+
+    @api.route("/books/{book_id:d}")
+    def book(req, resp, book_id):
+        resp.text = "book"
+
+    client.get("http://testserver/books/1")
+
+    [profile] = tmpdir.join("books_book_id_d").listdir()
+    stats = pstats.Stats(str(profile))
+
+    assert any(name == "book" for _, _, name in stats.stats)
+    # the profile is labelled with the match made for the handler
+    assert api.router.stats["dynamic_hits"] == 1
+
+
+def test_slow_requests_are_captured_as_collapsed_stacks(api, client, tmpdir):
+    api.enable_profiling(
+        str(tmpdir), sample_rate=0, slow_threshold=0.01, interval=0.001
+    )
+
+    @api.route("/slow")
+    def slow(req, resp):
+        time.sleep(0.1)
+        resp.text = "slow"
+
+    @api.route("/fast")
+    def fast(req, resp):
+        resp.text = "fast"
+
+    client.get("http://testserver/slow")
+    client.get("http://testserver/fast")
+
+    [stacks] = tmpdir.join("slow").listdir()
+    lines = stacks.read().splitlines()
+
+    assert not tmpdir.join("fast").check()
+    assert any(";test_py_octopus.py:slow " in line for line in lines)
+
+
+"""
+# Test Code for Testing Helpers
+
+"""
+from web_pyoctopus.testing import make_environ
+
+
+def test_make_environ_drives_the_wsgi_app_directly(api):
+    @api.route("/echo")
+    def echo(req, resp):
+        resp.json = {
+            "query": req.query,
+            "agent": req.headers.get("User-Agent"),
+            "body": req.text,
+        }
+
+    environ = make_environ(
+        "post",
+        "http://testserver/echo?page=2",
+        headers={"User-Agent": "bench"},
+        body=b"payload",
+    )
+    statuses = []
+    body = api(environ, lambda status, headers: statuses.append(status))
+
+    assert statuses == ["200 OK"]
+    assert json.loads(b"".join(body)) == {
+        "query": {"page": "2"},
+        "agent": "bench",
+        "body": "payload",
+    }
+
+
+def test_test_client_percent_decodes_the_path(api, client):
+    @api.route("/hello/{name}")
+    def hello(req, resp, name):
+        resp.text = name
+
+    assert client.get("/hello/John%20Doe").text == "John Doe"
+    assert client.get("/hello/caf%C3%A9").text == "café"
+    assert client.get("/hello/café").text == "café"
+
+
+"""
+# Test Code for the Load-Testing Harness
+
+"""
+from web_pyoctopus import loadtest
+
+
+def test_loadtest_reports_percentiles_per_route(api):
+    @api.route("/home")
+    def home(req, resp):
+        resp.text = "Hello"
+
+    report = loadtest.run_load(api, ["/home", "/missing"], requests=50, threads=2)
+
+    assert report["requests"] == 100
+    assert report["errors"] == 50
+    route = report["routes"]["/home"]
+    assert route["requests"] == 50
+    assert route["errors"] == 0
+    assert route["p50_ms"] <= route["p95_ms"] <= route["p99_ms"] <= route["p99.9_ms"]
+    missing = report["routes"]["/missing"]
+    assert missing["errors"] == 50
+    assert missing["error_statuses"] == {"404": 50}
+    formatted = loadtest.format_report(report)
+    assert "/home" in formatted
+    assert "404: 50" in formatted
+
+
+def test_loadtest_percentile():
+    values = [i / 1000 for i in range(1, 1001)]
+
+    assert loadtest.percentile(values, 50) == 0.501
+    assert loadtest.percentile(values, 99.9) == 1.0
+    assert loadtest.percentile([], 99) == 0.0
+
+
+"""
+# Test Code for the Test Client
+
+"""
+from web_pyoctopus.testing import HTTPError
+
+
+def test_test_client_relative_urls_params_and_json(api):
+    @api.route("/echo")
+    def echo(req, resp):
+        resp.json = {"query": req.query, "body": req.json, "method": req.method}
+
+    client = api.test_client()
+    response = client.put("/echo", params={"page": 2}, json={"name": "octopus"})
+
+    assert response.ok
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {
+        "query": {"page": "2"},
+        "body": {"name": "octopus"},
+        "method": "PUT",
+    }
+
+
+def test_test_client_keeps_cookies(api):
+    from webob import Response as WebObResponse
+
+    @api.route("/login")
+    def login(req, resp):
+        resp.webob = WebObResponse(text="ok")
+        resp.webob.set_cookie("session", "abc")
+
+    @api.route("/me")
+    def me(req, resp):
+        resp.text = req.cookies.get("session", "anonymous")
+
+    client = api.test_client()
+
+    assert client.get("/me").text == "anonymous"
+    assert client.get("/login").cookies == {"session": "abc"}
+    assert client.get("/me").text == "abc"
+
+
+def test_test_client_raise_for_status(api):
+    response = api.test_client().get("/missing")
+
+    assert response.status_code == 404
+    assert not response.ok
+    with pytest.raises(HTTPError, match="404 Client Error"):
+        response.raise_for_status()
+
+
+def test_test_client_from_many_threads(api):
+    @api.route("/square/{n:d}")
+    def square(req, resp, n):
+        resp.text = str(n * n)
+
+    client = api.test_client()
+    results = {}
+
+    def call(n):
+        results[n] = client.get(f"/square/{n}").text
+
+    threads = [threading.Thread(target=call, args=(n,)) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {n: str(n * n) for n in range(20)}
+
+
+"""
+# Test Code for Lazy Imports
+
+"""
+import subprocess
+import sys
+
+
+def test_importing_the_api_leaves_optional_subsystems_unloaded():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import web_pyoctopus.api"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = {
+        line.split("|")[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+    for module in ("asyncio", "jinja2", "requests", "webob", "whitenoise"):
+        assert module not in imported
+
+
+def test_cli_imports_command_dependencies_on_use():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import web_pyoctopus.__main__"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = {
+        line.split("|")[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+    for module in ("jinja2", "web_pyoctopus.loadtest", "web_pyoctopus.templates"):
+        assert module not in imported
+
+
+def test_templates_and_static_files_are_set_up_on_first_use(tmpdir):
+    templates_dir = tmpdir.mkdir("templates")
+    templates_dir.join("hello.html").write("Hello, {{ name }}!")
+    api = OctopusAPI(templates_dir=str(templates_dir), static_dir=str(tmpdir))
+
+    assert api._templates_env is None
+    assert api._whitenoise is None
+    assert api.template("hello.html", {"name": "Octopus"}) == "Hello, Octopus!"
+    assert api._templates_env is api.templates_env
+
+
+"""
+# Test Code for Precompressed Static Files
+
+"""
+import gzip
+
+from web_pyoctopus import static
+
+
+def _static_api(tmpdir, **options):
+    static_dir = tmpdir.mkdir("static")
+    static_dir.join("app.css").write("body { color: red }\n" * 200)
+    static_dir.join("app.3f2a9c1b7d4e.js").write("console.log(1)")
+    static_dir.join("big.bin").write_binary(bytes(range(256)) * 64)
+
+    api = OctopusAPI(static_dir=str(static_dir))
+    api.enable_static_files(
+        precompress=True, max_cached_size=1024, mmap_threshold=8 * 1024, **options
+    )
+    return api, static_dir
+
+
+def test_static_files_serve_precompressed_variants(tmpdir):
+    api, static_dir = _static_api(tmpdir)
+    client = api.test_client()
+
+    assert static_dir.join("app.css.gz").check()
+    plain = client.get("/static/app.css")
+    compressed = client.get("/static/app.css", headers={"Accept-Encoding": "gzip"})
+    refused = client.get(
+        "/static/app.css", headers={"Accept-Encoding": "gzip;q=0, deflate"}
+    )
+
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["content-type"] == "text/css; charset=UTF-8"
+    assert plain.headers["vary"] == "Accept-Encoding"
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(compressed.content) == plain.content
+    assert "content-encoding" not in refused.headers
+    assert compressed.headers["etag"] == plain.headers["etag"][:-1] + '-gzip"'
+
+    # only the served variant's ETag revalidates
+    revalidated = client.get(
+        "/static/app.css",
+        headers={
+            "Accept-Encoding": "gzip",
+            "If-None-Match": compressed.headers["etag"],
+        },
+    )
+    other_variant = client.get(
+        "/static/app.css", headers={"If-None-Match": compressed.headers["etag"]}
+    )
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == compressed.headers["etag"]
+    assert other_variant.status_code == 200
+    assert other_variant.headers["etag"] == plain.headers["etag"]
+
+
+def test_static_files_cache_headers_and_304(tmpdir):
+    api, _ = _static_api(tmpdir)
+    client = api.test_client()
+
+    hashed = client.get("/static/app.3f2a9c1b7d4e.js")
+    plain = client.get("/static/app.css")
+    revalidated = client.get(
+        "/static/app.css", headers={"If-None-Match": plain.headers["etag"]}
+    )
+
+    assert hashed.headers["cache-control"] == static.IMMUTABLE_CACHE_CONTROL
+    assert plain.headers["cache-control"] == "max-age=60, public"
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert client.get("/static/missing.css").status_code == 404
+
+
+def test_static_files_memory_cache_and_mmap(tmpdir):
+    api, static_dir = _static_api(tmpdir)
+    client = api.test_client()
+
+    assert client.get("/static/app.3f2a9c1b7d4e.js").text == "console.log(1)"
+    static_dir.join("app.3f2a9c1b7d4e.js").write("console.log(2)")
+    # served from memory, not reopened
+    assert client.get("/static/app.3f2a9c1b7d4e.js").text == "console.log(1)"
+
+    environ = make_environ(path="/static/big.bin")
+    body = api(environ, lambda status, headers: None)
+    assert isinstance(body, static.MmapBody)
+    assert b"".join(body) == bytes(range(256)) * 64
+
+
+def test_static_files_autorefresh_picks_up_changes(tmpdir):
+    api, static_dir = _static_api(tmpdir, autorefresh=True)
+    client = api.test_client()
+
+    static_dir.join("new.txt").write("new")
+    assert client.get("/static/new.txt").text == "new"
+    assert client.get("/static/../../etc/passwd").status_code == 404
+
+
+"""
+# Test Code for the Static Asset Manifest
+
+"""
+
+def test_build_manifest_hashes_files(tmpdir):
+    static_dir = tmpdir.mkdir("static")
+    static_dir.mkdir("css").join("app.css").write("body { color: red }")
+    static_dir.join("report.20241018.pdf").write("report")
+
+    manifest = static.build_manifest(str(static_dir))
+    hashed = manifest["css/app.css"]
+    # a dated name is not mistaken for a content hash
+    assert "report.20241018.pdf" in manifest
+    assert not static.is_hashed(None, "/report.20241018.pdf")
+
+    assert static.HASHED_NAME.search(hashed)
+    assert static_dir.join(*hashed.split("/")).read() == "body { color: red }"
+    assert static.load_manifest(str(static_dir)) == manifest
+    # hashed copies are not hashed again
+    assert static.build_manifest(str(static_dir)) == manifest
+
+
+def test_static_url_in_templates_and_immutable_serving(tmpdir):
+    static_dir = tmpdir.mkdir("static")
+    static_dir.join("app.css").write("body { color: red }")
+    templates_dir = tmpdir.mkdir("templates")
+    templates_dir.join("page.html").write('{{ static_url("app.css") }}')
+    hashed = static.build_manifest(str(static_dir))["app.css"]
+
+    api = OctopusAPI(templates_dir=str(templates_dir), static_dir=str(static_dir))
+    client = api.test_client()
+
+    assert api.template("page.html") == f"/static/{hashed}"
+    assert api.static_url("missing.css") == "/static/missing.css"
+
+    hashed_response = client.get(f"/static/{hashed}")
+    assert hashed_response.text == "body { color: red }"
+    assert "immutable" in hashed_response.headers["cache-control"]
+    assert "immutable" not in client.get("/static/app.css").headers.get(
+        "cache-control", ""
+    )
+
+
+"""
+# Test Code for the Compiled Middleware Pipeline
+
+"""
+from web_pyoctopus.response import Response
+
+
+def _recording_middleware(calls, name, short_circuit=False):
+    class Recording(Middleware):
+        def process_request(self, req):
+            calls.append(f"{name}.request")
+            if short_circuit:
+                response = Response()
+                response.status_code = 403
+                response.text = "Forbidden"
+                return response
+
+        def process_response(self, req, resp):
+            calls.append(f"{name}.response")
+
+    return Recording
+
+
+def test_middleware_hooks_run_in_order(api, client):
+    calls = []
+    api.add_middleware(_recording_middleware(calls, "inner"))
+    api.add_middleware(_recording_middleware(calls, "outer"))
+
+    @api.route("/")
+    def index(req, resp):
+        calls.append("handler")
+        resp.text = "ok"
+
+    assert client.get("/").text == "ok"
+    assert calls == [
+        "outer.request",
+        "inner.request",
+        "handler",
+        "inner.response",
+        "outer.response",
+    ]
+
+
+def test_middleware_process_request_can_short_circuit(api, client):
+    calls = []
+    api.add_middleware(_recording_middleware(calls, "inner"))
+    api.add_middleware(_recording_middleware(calls, "guard", short_circuit=True))
+    api.add_middleware(_recording_middleware(calls, "outer"))
+
+    @api.route("/")
+    def index(req, resp):
+        calls.append("handler")
+
+    response = client.get("/")
+
+    assert response.status_code == 403
+    assert response.text == "Forbidden"
+    assert calls == [
+        "outer.request",
+        "guard.request",
+        "guard.response",
+        "outer.response",
+    ]
+
+
+def test_middleware_without_hooks_is_compiled_away(api, client):
+    class PassThrough(Middleware):
+        pass
+
+    for _ in range(5):
+        api.add_middleware(PassThrough)
+
+    @api.route("/")
+    def index(req, resp):
+        resp.text = "ok"
+
+    assert api.middleware.pipeline is api
+    assert client.get("/").text == "ok"
+
+
+def test_middleware_around_a_wrapping_middleware(api, client):
+    calls = []
+    api.add_middleware(_recording_middleware(calls, "inner"))
+    api.add_middleware(CacheMiddleware)
+    api.add_middleware(_recording_middleware(calls, "outer"))
+
+    @api.route("/report", cache_ttl=60)
+    def report(req, resp):
+        calls.append("handler")
+        resp.text = "report"
+
+    client.get("/report")
+    calls.clear()
+
+    assert client.get("/report").text == "report"
+    assert calls == ["outer.request", "outer.response"]
+
+
+def test_sync_handle_request_override_runs_under_asgi(api, client):
+    class Deny(Middleware):
+        def handle_request(self, request):
+            if request.headers.get("X-Token") != "secret":
+                response = Response()
+                response.status_code = 403
+                return response
+            return self.app.handle_request(request)
+
+    api.add_middleware(Deny)
+
+    @api.route("/admin")
+    def admin(req, resp):
+        resp.text = "admin"
+
+    assert client.get("/admin").status_code == 403
+    assert _asgi_request(api, "/admin")[0] == 403
+    assert _asgi_request(api, "/admin", headers={"X-Token": "secret"}) == (
+        200,
+        b"admin",
+    )
+
+
+def test_middleware_hooks_are_timed_with_metrics(api, client):
+    calls = []
+    api.add_middleware(_recording_middleware(calls, "recording"))
+    api.enable_metrics()
+
+    @api.route("/")
+    def index(req, resp):
+        resp.text = "ok"
+
+    client.get("/")
+    text = client.get("/metrics").text
+
+    assert (
+        'octopus_middleware_seconds_count{middleware="Recording",'
+        'hook="process_request"} 2' in text
+    )
+
+
+"""
+# Test Code for Request Body Streaming and Uploads
+
+"""
+import io
+
+from web_pyoctopus.multipart import UploadFile
+
+
+def _multipart_body(boundary, fields, files):
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n".encode()
+        )
+    for name, (filename, content) in files.items():
+        parts.append(
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; "
+            f'filename="{filename}"\r\nContent-Type: text/csv\r\n\r\n'.encode()
+            + content
+            + b"\r\n"
+        )
+    return b"".join(parts) + f"--{boundary}--\r\n".encode()
+
+
+def test_request_stream_yields_the_body_in_chunks():
+    environ = make_environ("POST", "/", body=b"x" * 10)
+    request = Request(environ)
+
+    assert list(request.stream(chunk_size=4)) == [b"xxxx", b"xxxx", b"xx"]
+    with pytest.raises(RuntimeError):
+        list(request.stream())
+
+
+def test_request_stream_async(api):
+    @api.route("/upload")
+    async def upload(req, resp):
+        resp.text = str(sum([len(chunk) async for chunk in req.stream_async(3)]))
+
+    assert api.test_client().post("/upload", data=b"abcdefgh").text == "8"
+    assert _asgi_request(api, "/upload", "POST", b"abcdefgh") == (200, b"8")
+
+
+def test_multipart_upload_is_spooled(api):
+    boundary = "octopus-boundary"
+    csv = b"id,name\n" + b"1,octopus\n" * 1000
+
+    @api.route("/import", spool_size=1024)
+    def import_csv(req, resp):
+        upload = req.files["data"]
+        assert isinstance(upload, UploadFile)
+        assert upload.file._rolled
+        resp.json = {
+            "title": req.form["title"],
+            "filename": upload.filename,
+            "size": upload.size,
+            "content_type": upload.content_type,
+            "matches": upload.read() == csv,
+        }
+
+    body = _multipart_body(boundary, {"title": "Octopi"}, {"data": ("o.csv", csv)})
+    response = api.test_client().post(
+        "/import",
+        data=body,
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+
+    assert response.json() == {
+        "title": "Octopi",
+        "filename": "o.csv",
+        "size": len(csv),
+        "content_type": "text/csv",
+        "matches": True,
+    }
+
+
+def test_multipart_boundary_split_across_chunks():
+    from web_pyoctopus.multipart import parse_multipart
+
+    body = _multipart_body("b", {"a": "1", "b": "2"}, {"f": ("f.txt", b"xyz" * 50)})
+    chunks = [body[i : i + 3] for i in range(0, len(body), 3)]
+
+    form, files = parse_multipart(chunks, b"b")
+
+    assert form == {"a": "1", "b": "2"}
+    assert files["f"].read() == b"xyz" * 50
+
+
+def test_malformed_multipart_is_a_bad_request(api):
+    @api.route("/import", allowed_methods=["post"])
+    def import_csv(req, resp):
+        resp.json = req.form
+
+    client = api.test_client()
+    truncated = _multipart_body("b", {"a": "1"}, {})[:-8]
+    response = client.post(
+        "/import",
+        data=truncated,
+        headers={"Content-Type": "multipart/form-data; boundary=b"},
+    )
+    assert response.status_code == 400
+
+    response = client.post(
+        "/import", data=b"--", headers={"Content-Type": "multipart/form-data"}
+    )
+    assert response.status_code == 400
+
+
+def test_undecodable_form_is_a_bad_request(api, monkeypatch):
+    from web_pyoctopus import multipart
+
+    @api.route("/form", allowed_methods=["post"])
+    def form(req, resp):
+        resp.json = req.form
+
+    client = api.test_client()
+    field = b'--b\r\nContent-Disposition: form-data; name="a"\r\n'
+    for headers, value in (
+        (b"", b"\xff"),
+        (b"Content-Type: text/plain; charset=bogus\r\n", b"1"),
+    ):
+        body = field + headers + b"\r\n" + value + b"\r\n--b--\r\n"
+        response = client.post(
+            "/form",
+            data=body,
+            headers={"Content-Type": "multipart/form-data; boundary=b"},
+        )
+        assert response.status_code == 400
+
+    response = client.post(
+        "/form",
+        data=b"a=\xff",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert response.status_code == 400
+
+    monkeypatch.setattr(multipart, "MAX_FIELDS", 2)
+    fields = {"a": "1", "b": "2", "c": "3"}
+    assert client.post("/form", data=fields).status_code == 400
+    response = client.post(
+        "/form",
+        data=_multipart_body("b", fields, {}),
+        headers={"Content-Type": "multipart/form-data; boundary=b"},
+    )
+    assert response.status_code == 400
+
+
+def test_urlencoded_form(api):
+    @api.route("/form")
+    def form(req, resp):
+        resp.json = req.form
+
+    response = api.test_client().post("/form", data={"name": "Octopus", "arms": 8})
+
+    assert response.json() == {"name": "Octopus", "arms": "8"}
+
+
+def test_repeated_form_fields_and_files_are_kept(api):
+    from web_pyoctopus.multipart import parse_multipart
+
+    @api.route("/form", allowed_methods=["post"])
+    def form(req, resp):
+        resp.json = {"last": req.form["tag"], "all": req.form.getlist("tag")}
+
+    response = api.test_client().post("/form", data={"tag": ["a", "b"]})
+    assert response.json() == {"last": "b", "all": ["a", "b"]}
+
+    first = _multipart_body("b", {"tag": "x"}, {"f": ("1.txt", b"one")})
+    second = _multipart_body("b", {"tag": "y"}, {"f": ("2.txt", b"two")})
+    # join the two bodies into one, dropping the first closing boundary
+    body = first[: -len("--b--\r\n")] + second
+
+    form, files = parse_multipart([body], b"b")
+
+    assert form.getlist("tag") == ["x", "y"]
+    assert [upload.filename for upload in files.getlist("f")] == ["1.txt", "2.txt"]
+    assert files["f"].read() == b"two"
+    assert form.getlist("missing") == []
+
+
+def test_max_body_size_is_enforced_before_reading(api):
+    reads = []
+
+    class Input(io.BytesIO):
+        def read(self, *args):
+            reads.append(args)
+            return super().read(*args)
+
+    @api.route("/small", max_body_size=4)
+    def small(req, resp):
+        resp.text = req.text
+
+    environ = make_environ("POST", "/small", body=b"too large")
+    environ["wsgi.input"] = Input(b"too large")
+    client = api.test_client()
+
+    assert client.post("/small", data=b"ok").text == "ok"
+    assert client.post("/small", data=b"too large").status_code == 413
+    assert _asgi_request(api, "/small", "POST", b"too large")[0] == 413
+    response = api.handle_request(Request(environ))
+    assert response.status_code == 413
+    assert reads == []
+
+
+def test_max_body_size_without_content_length():
+    app = OctopusAPI(max_body_size=4)
+
+    @app.route("/chunked")
+    def chunked(req, resp):
+        resp.text = req.text
+
+    environ = make_environ("POST", "/chunked")
+    environ["wsgi.input"] = io.BytesIO(b"way too large")
+    environ["wsgi.input_terminated"] = True
+
+    assert app.handle_request(Request(environ)).status_code == 413
+
+
+def test_invalid_content_length_is_a_bad_request():
+    app = OctopusAPI(max_body_size=4)
+
+    @app.route("/upload")
+    def upload(req, resp):
+        resp.text = req.text
+
+    environ = make_environ("POST", "/upload", body=b"ok")
+    environ["CONTENT_LENGTH"] = "abc"
+
+    assert app.handle_request(Request(environ)).status_code == 400
+
+
+def test_asgi_spools_large_bodies(api, monkeypatch):
+    from web_pyoctopus import asgi
+
+    monkeypatch.setattr(asgi, "SPOOL_SIZE", 4)
+
+    @api.route("/upload")
+    def upload(req, resp):
+        resp.text = f"{type(req.environ['wsgi.input']).__name__} {len(req.body)}"
+
+    assert _asgi_request(api, "/upload", "POST", b"x" * 10) == (
+        200,
+        b"SpooledTemporaryFile 10",
+    )
+
+
+"""
+# Test Code for Response Compression
+
+"""
+from web_pyoctopus.compression import CompressionMiddleware
+
+GZIP = {"Accept-Encoding": "gzip"}
+
+
+def test_compression_negotiates_gzip(api, client):
+    api.add_middleware(CompressionMiddleware)
+
+    @api.route("/data")
+    def data(req, resp):
+        resp.json = {"items": list(range(500))}
+
+    plain = client.get("/data")
+    compressed = client.get("/data", headers=GZIP)
+
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["vary"] == "Accept-Encoding"
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert len(compressed.content) < len(plain.content)
+    assert gzip.decompress(compressed.content) == plain.content
+
+
+def test_compression_skips_small_and_binary_bodies(api, client):
+    api.add_middleware(CompressionMiddleware, min_size=100)
+
+    @api.route("/small")
+    def small(req, resp):
+        resp.text = "tiny"
+
+    @api.route("/image")
+    def image(req, resp):
+        resp.body = b"\x89PNG" * 100
+        resp.content_type = "image/png"
+
+    @api.route("/off", compress=False)
+    def off(req, resp):
+        resp.text = "x" * 1000
+
+    for path in ("/small", "/image", "/off"):
+        assert "content-encoding" not in client.get(path, headers=GZIP).headers
+
+
+def test_compression_skips_already_encoded_bodies(api, client):
+    api.add_middleware(CompressionMiddleware)
+    text = " ".join(str(i * i) for i in range(1000)).encode()
+    payload = gzip.compress(text)
+
+    @api.route("/encoded")
+    def encoded(req, resp):
+        resp.body = payload
+        resp.content_type = "text/plain"
+        resp.headers["content-encoding"] = "gzip"
+
+    response = client.get("/encoded", headers=GZIP)
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(response.content) == text
+
+
+def test_compression_of_streams_and_route_levels(api, client):
+    api.add_middleware(CompressionMiddleware)
+
+    @api.route("/stream", compression_level=1)
+    def stream(req, resp):
+        resp.content_type = "text/plain"
+        resp.stream = (f"line {i}\n" for i in range(1000))
+
+    response = client.get("/stream", headers=GZIP)
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    expected = "".join(f"line {i}\n" for i in range(1000)).encode()
+    assert gzip.decompress(response.content) == expected
+
+    status, body = _asgi_request(api, "/stream", headers=GZIP)
+    assert status == 200
+    assert gzip.decompress(body) == expected
+
+
+def test_compression_caches_compressed_variants(api, client, monkeypatch):
+    from web_pyoctopus import compression
+
+    calls = []
+    original = compression.compress
+    monkeypatch.setattr(
+        compression, "compress", lambda *args: calls.append(1) or original(*args)
+    )
+    api.add_middleware(CacheMiddleware)
+    api.add_middleware(CompressionMiddleware, cache=True)
+
+    @api.route("/report", cache_ttl=60)
+    def report(req, resp):
+        resp.text = "report " * 200
+
+    first = client.get("/report", headers=GZIP)
+    second = client.get("/report", headers=GZIP)
+    revalidated = client.get(
+        "/report", headers={**GZIP, "If-None-Match": first.headers["etag"]}
+    )
+
+    assert first.content == second.content
+    assert first.headers["etag"].startswith("W/")
+    assert revalidated.status_code == 304
+    assert len(calls) == 1
+
+
+"""
+# Test Code for Admission Control
+
+"""
+from web_pyoctopus.admission import queue_start
+
+
+def test_admission_control_sheds_by_concurrency_and_priority(api):
+    admission = api.enable_admission_control(max_concurrency=10, retry_after=5)
+
+    @api.route("/report", priority="low")
+    def report(req, resp):
+        resp.text = "report"
+
+    @api.route("/health", priority="critical")
+    def health(req, resp):
+        resp.text = "ok"
+
+    client = api.test_client()
+    assert client.get("/report").text == "report"
+    assert admission.in_flight == 0
+
+    admission.in_flight = 5
+    rejected = client.get("/report")
+    assert rejected.status_code == 503
+    assert rejected.headers["retry-after"] == "5"
+    assert client.get("/health").text == "ok"
+
+    admission.in_flight = 10
+    assert client.get("/health").status_code == 503
+    assert _asgi_request(api, "/health")[0] == 503
+
+    admission.in_flight = 9
+    assert _asgi_request(api, "/health") == (200, b"ok")
+    assert admission.in_flight == 9
+
+
+def test_admission_control_sheds_by_queue_time(api):
+    api.enable_admission_control(max_queue_time=0.5)
+    api.enable_metrics()
+
+    @api.route("/")
+    def index(req, resp):
+        resp.text = "ok"
+
+    client = api.test_client()
+    fresh = {"X-Request-Start": f"t={time.time():.3f}"}
+    stale = {"X-Request-Start": f"t={int((time.time() - 2) * 1e6)}"}
+
+    assert client.get("/", headers=fresh).text == "ok"
+    assert client.get("/", headers=stale).status_code == 503
+
+    metrics = client.get("/metrics").text
+    assert (
+        'octopus_admission_total{decision="rejected",reason="queue_time",'
+        'priority="normal"} 1' in metrics
+    )
+
+
+def test_admission_control_routes_each_request_once(api):
+    api.enable_admission_control(max_concurrency=10)
+    api.enable_metrics()
+
+    @api.route("/books/{book_id:d}", priority="low")
+    def book(req, resp, book_id):
+        resp.text = str(book_id)
+
+    assert api.test_client().get("/books/7").text == "7"
+    assert sum(api.router.stats.values()) == 1
+
+
+def test_admission_slot_is_held_while_streaming(api):
+    admission = api.enable_admission_control(max_concurrency=10)
+
+    @api.route("/stream")
+    def stream(req, resp):
+        resp.stream = iter([b"a", b"b"])
+
+    body = api(make_environ(path="/stream"), lambda status, headers: None)
+    assert admission.in_flight == 1
+    assert b"".join(body) == b"ab"
+    body.close()
+    assert admission.in_flight == 0
+
+
+def test_queue_start_units():
+    assert queue_start({"HTTP_X_REQUEST_START": "t=1700000000.250"}) == 1700000000.25
+    assert queue_start({"HTTP_X_REQUEST_START": "1700000000250"}) == 1700000000.25
+    assert queue_start({"HTTP_X_QUEUE_START": "t=1700000000250000"}) == 1700000000.25
+    assert queue_start({"HTTP_X_REQUEST_START": "garbage"}) is None
+
+
+"""
+# Test Code for Rate Limiting
+
+"""
+from web_pyoctopus.ratelimit import (
+    MemoryRateLimit,
+    RateLimitMiddleware,
+    SharedMemoryRateLimit,
+    gcra,
+    parse_rate,
+)
+
+
+def test_parse_rate_and_gcra():
+    assert parse_rate("5/minute") == (5, 60.0, 5)
+    assert parse_rate("10/seconds") == (10, 1.0, 10)
+    assert parse_rate((3, 2, 6)) == (3, 2.0, 6)
+    with pytest.raises(ValueError):
+        parse_rate("5/fortnight")
+
+    # 1 request per second with a burst of 2
+    tat, wait = gcra(0.0, 100.0, 1.0, 1.0)
+    assert (tat, wait) == (101.0, 0.0)
+    tat, wait = gcra(tat, 100.0, 1.0, 1.0)
+    assert (tat, wait) == (102.0, 0.0)
+    assert gcra(tat, 100.0, 1.0, 1.0) == (None, 1.0)
+    assert gcra(tat, 101.0, 1.0, 1.0) == (103.0, 0.0)
+
+
+def test_rate_limit_per_route_and_key(api):
+    api.add_middleware(RateLimitMiddleware, rate="100/minute")
+    api.enable_metrics()
+
+    @api.route("/login", rate_limit="2/minute")
+    def login(req, resp):
+        resp.text = "welcome"
+
+    @api.route("/search", rate_limit=(1, 60), rate_limit_key="header:X-Api-Key")
+    def search(req, resp):
+        resp.text = "results"
+
+    @api.route("/health", rate_limit=None)
+    def health(req, resp):
+        resp.text = "ok"
+
+    client = api.test_client()
+    assert client.get("/login").text == "welcome"
+    assert client.get("/login").text == "welcome"
+    limited = client.get("/login")
+    assert limited.status_code == 429
+    assert 1 <= int(limited.headers["retry-after"]) <= 30
+
+    assert client.get("/search", headers={"X-Api-Key": "a"}).status_code == 200
+    assert client.get("/search", headers={"X-Api-Key": "b"}).status_code == 200
+    assert client.get("/search", headers={"X-Api-Key": "a"}).status_code == 429
+
+    for _ in range(5):
+        assert client.get("/health").text == "ok"
+
+    assert 'octopus_rate_limited_total{route="/login"} 1' in client.get("/metrics").text
+
+
+def test_shared_memory_rate_limit_is_shared_between_stores(tmp_path):
+    path = str(tmp_path / "ratelimit")
+    first = SharedMemoryRateLimit(path, slots=16)
+    second = SharedMemoryRateLimit(path, slots=16)
+
+    assert first.acquire("client", 60.0, 60.0) == 0.0
+    assert second.acquire("client", 60.0, 60.0) == 0.0
+    assert first.acquire("client", 60.0, 60.0) > 0
+    assert second.acquire("other", 60.0, 60.0) == 0.0
+
+    # more keys than slots: the ones closest to expiring are reused
+    for number in range(64):
+        assert first.acquire(f"key-{number}", 1.0, 0.0) == 0.0
+
+    first.close()
+    second.close()
+
+
+def test_memory_rate_limit_evicts_least_recent_keys():
+    store = MemoryRateLimit(max_keys=2)
+    for key in "abac":
+        assert store.acquire(key, 0.0, 0.0) == 0.0
+    assert list(store.tats) == ["a", "c"]
+
+
+"""
+# Test Code for Background Tasks
+
+"""
+
+def test_background_tasks_run_after_the_body_is_sent(api):
+    api.enable_metrics()
+    done = threading.Event()
+    events = []
+
+    def audit(user, action):
+        events.append((user, action))
+        done.set()
+
+    @api.route("/login")
+    def login(req, resp):
+        resp.text = "welcome"
+        resp.background(audit, "alice", action="login")
+
+    body = api(make_environ(path="/login"), lambda status, headers: None)
+    assert b"".join(body) == b"welcome"
+    assert events == []
+
+    body.close()
+    assert done.wait(5)
+    assert api.background_tasks.drain(timeout=5)
+    assert events == [("alice", "login")]
+
+    metrics = api.metrics.render()
+    assert (
+        'octopus_background_tasks_total{task="test_background_tasks_run_after_the_'
+        'body_is_sent.<locals>.audit",outcome="done"} 1' in metrics
+    )
+    assert "octopus_background_queue_depth 0" in metrics
+
+
+def test_background_tasks_run_on_cached_routes(api, client):
+    api.add_middleware(CacheMiddleware)
+    ran = []
+
+    @api.route("/report", cache_ttl=60)
+    def report(req, resp):
+        resp.text = "report"
+        resp.background(ran.append, "warmed")
+
+    assert client.get("/report").text == "report"
+    assert client.get("/report").text == "report"
+    assert api.background_tasks.drain(timeout=5)
+    # the second request is served from the cache, without the handler
+    assert ran == ["warmed"]
+
+
+def test_background_queue_limit_and_drain(api):
+    tasks = api.enable_background_tasks(max_workers=1, max_queue=2)
+    release = threading.Event()
+    finished = []
+
+    def slow(number):
+        release.wait(5)
+        finished.append(number)
+
+    assert api.background(slow, 1)
+    assert api.background(slow, 2)
+    assert not api.background(slow, 3)
+
+    release.set()
+    assert tasks.drain(timeout=5)
+    assert sorted(finished) == [1, 2]
+    # closed once drained
+    assert not api.background(slow, 4)
+
+
+def test_background_tasks_left_at_exit_are_cancelled_after_the_timeout():
+    script = """if True:
+        import time
+        from web_pyoctopus.api import OctopusAPI
+
+        app = OctopusAPI()
+        app.enable_background_tasks(max_workers=1, drain_timeout=0.1)
+        for number in range(3):
+            app.background(lambda number=number: time.sleep(0.5) or print(number))
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=10,
+    )
+
+    assert result.stdout.split() == ["0"]
+
+
+def test_background_submit_after_executor_shutdown_is_dropped(api):
+    from concurrent.futures import ThreadPoolExecutor
+
+    tasks = api.enable_background_tasks()
+    tasks._executor = ThreadPoolExecutor()
+    tasks._executor.shutdown()
+
+    assert not api.background(print, "late")
+    assert tasks.pending == 0
+
+
+def test_async_background_tasks_run_on_the_event_loop(api):
+    api.enable_background_tasks()
+    ran = []
+
+    async def notify(name):
+        await asyncio.sleep(0.01)
+        ran.append((name, threading.current_thread() is threading.main_thread()))
+
+    @api.route("/signup")
+    async def signup(req, resp):
+        resp.text = "ok"
+        resp.background(notify, "bob")
+
+    async def serve():
+        sent = []
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+        scope = {"type": "http", "method": "GET", "path": "/signup", "headers": []}
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await api.asgi(scope, receive, send)
+        assert ran == []
+
+        lifespan = [{"type": "lifespan.shutdown"}]
+
+        async def receive_lifespan():
+            return lifespan.pop(0)
+
+        await api.asgi({"type": "lifespan"}, receive_lifespan, send)
+        return sent
+
+    sent = asyncio.run(serve())
+    assert sent[-1] == {"type": "lifespan.shutdown.complete"}
+    assert ran == [("bob", True)]
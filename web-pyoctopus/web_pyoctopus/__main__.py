@@ -0,0 +1,112 @@
+# __main__.py
+import argparse
+import sys
+
+
+def compile_templates(args):
+    from .templates import make_environment, precompile
+
+    templates_env = make_environment(args.templates_dir, template_cache=args.cache_dir)
+    names = precompile(templates_env)
+
+    print(f"Compiled {len(names)} templates into {args.cache_dir}")
+
+
+def build_manifest(args):
+    from .static import MANIFEST_NAME, build_manifest
+
+    manifest = build_manifest(args.static_dir)
+
+    print(f"Hashed {len(manifest)} files into {args.static_dir}/{MANIFEST_NAME}")
+
+
+def compress_static(args):
+    from .static import compress_directory
+
+    written = compress_directory(args.static_dir, min_size=args.min_size)
+
+    print(f"Wrote {len(written)} compressed files into {args.static_dir}")
+
+
+def run_loadtest(args):
+    from . import loadtest
+
+    if args.gunicorn:
+        process, port = loadtest.spawn_gunicorn(args.app, workers=args.gunicorn)
+        try:
+            report = loadtest.run_http_load(
+                "127.0.0.1",
+                port,
+                args.paths,
+                requests=args.requests,
+                threads=args.threads,
+                processes=args.processes,
+                method=args.method,
+            )
+        finally:
+            process.terminate()
+            process.wait()
+    else:
+        report = loadtest.run_load(
+            args.app,
+            args.paths,
+            requests=args.requests,
+            threads=args.threads,
+            processes=args.processes,
+            method=args.method,
+        )
+
+    print(loadtest.format_report(report))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m web_pyoctopus")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser(
+        "compile-templates",
+        help="compile every template into a bytecode cache directory",
+    )
+    command.add_argument("templates_dir")
+    command.add_argument("cache_dir")
+    command.set_defaults(run=compile_templates)
+
+    command = commands.add_parser(
+        "build-manifest",
+        help="copy static files to content-hashed names and write manifest.json",
+    )
+    command.add_argument("static_dir")
+    command.set_defaults(run=build_manifest)
+
+    command = commands.add_parser(
+        "compress-static",
+        help="write gzip (and brotli, if installed) variants of static files",
+    )
+    command.add_argument("static_dir")
+    command.add_argument("--min-size", type=int, default=256)
+    command.set_defaults(run=compress_static)
+
+    command = commands.add_parser(
+        "loadtest",
+        help="drive an app from many threads and report latency percentiles",
+    )
+    command.add_argument("app", help="import string of the app, e.g. app:app")
+    command.add_argument("paths", nargs="+")
+    command.add_argument("--requests", type=int, default=10000, help="per thread")
+    command.add_argument("--threads", type=int, default=4)
+    command.add_argument("--processes", type=int, default=1)
+    command.add_argument("--method", default="GET")
+    command.add_argument(
+        "--gunicorn",
+        type=int,
+        metavar="WORKERS",
+        help="serve the app with Gunicorn on loopback and drive it over HTTP",
+    )
+    command.set_defaults(run=run_loadtest)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# admission.py
+import threading
+import time
+
+from .request import Request
+from .response import Response
+
+
+# share of the concurrency and queue-time budgets each priority class may use,
+# so low-priority routes are shed first and critical ones last
+DEFAULT_PRIORITIES = {"critical": 1.0, "normal": 0.9, "low": 0.5}
+DEFAULT_PRIORITY = "normal"
+
+QUEUE_START_HEADERS = ("HTTP_X_REQUEST_START", "HTTP_X_QUEUE_START")
+
+
+def queue_start(environ):
+    """
+    Time the request entered the proxy queue, from `X-Request-Start` or
+    `X-Queue-Start` (`t=<seconds|milliseconds|microseconds>`), or None.
+    """
+
+    for key in QUEUE_START_HEADERS:
+        value = environ.get(key)
+        if not value:
+            continue
+        if value.startswith("t="):
+            value = value[2:]
+        try:
+            start = float(value)
+        except ValueError:
+            continue
+        # nginx sends seconds.milliseconds, others whole ms or µs
+        if start > 1e14:
+            start /= 1e6
+        elif start > 1e11:
+            start /= 1e3
+        return start
+    return None
+
+
+class ReleasingBody:
+    """
+    # WSGI Iterable Releasing its Admission Slot When Closed
+
+    Keeps a streamed response counted as in flight until the server has
+    sent it.
+    """
+
+    def __init__(self, body, release):
+        self.body = body
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            self.release()
+
+
+class AdmissionControl:
+    """
+    # Worker-Level Admission Control
+
+    Counts the requests in flight in this worker and sheds load before it
+    builds up: a request is answered with 503 and `Retry-After` when
+    admitting it would exceed `max_concurrency`, or when it has already
+    waited longer than `max_queue_time` seconds in the proxy queue (from
+    `X-Request-Start`). Each route's `priority` option names a class in
+    `priorities`, the share of both budgets that class may use, so
+    low-priority routes are shed well before critical ones. Decisions are
+    counted in `octopus_admission_total` when metrics are enabled.
+    """
+
+    def __init__(
+        self,
+        app,
+        max_concurrency=None,
+        max_queue_time=None,
+        retry_after=1,
+        priorities=None,
+    ):
+        self.app = app
+        self.max_concurrency = max_concurrency
+        self.max_queue_time = max_queue_time
+        self.retry_after = retry_after
+        self.priorities = {**DEFAULT_PRIORITIES, **(priorities or {})}
+
+        # below these, every priority class is admitted without a route lookup
+        self.min_share = min(self.priorities.values())
+
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def priority(self, environ):
+        # routed once: the match is kept in the environ for the handler
+        handler_data = Request(environ).route[0]
+        if handler_data is None:
+            return DEFAULT_PRIORITY
+        return handler_data["options"].get("priority", DEFAULT_PRIORITY)
+
+    def try_acquire(self, environ):
+        """
+        Takes a slot for the request and returns None, or returns the
+        reason it is rejected.
+        """
+
+        queue_time = None
+        if self.max_queue_time is not None:
+            start = queue_start(environ)
+            if start is not None:
+                queue_time = max(time.time() - start, 0.0)
+
+        priority = None
+        with self.lock:
+            reason = self.over_budget(self.in_flight, queue_time, self.min_share)
+            if reason is None:
+                self.in_flight += 1
+
+        if reason is not None:
+            # close to a budget: only some priority classes get in
+            priority = self.priority(environ)
+            share = self.priorities.get(priority, 1.0)
+            with self.lock:
+                reason = self.over_budget(self.in_flight, queue_time, share)
+                if reason is None:
+                    self.in_flight += 1
+
+        metrics = self.app.metrics
+        if metrics is not None:
+            if priority is None:
+                priority = self.priority(environ)
+            labels = (
+                ("decision", "admitted" if reason is None else "rejected"),
+                ("reason", reason or ""),
+                ("priority", priority),
+            )
+            metrics.inc("octopus_admission_total", labels)
+            metrics.set_gauge("octopus_admission_in_flight", self.in_flight)
+            if queue_time is not None:
+                metrics.observe("octopus_queue_time_seconds", queue_time)
+
+        return reason
+
+    def over_budget(self, in_flight, queue_time, share):
+        if self.max_concurrency is not None:
+            if in_flight >= max(int(self.max_concurrency * share), 1):
+                return "concurrency"
+        if queue_time is not None and queue_time > self.max_queue_time * share:
+            return "queue_time"
+        return None
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def rejection(self):
+        response = Response()
+        response.status_code = 503
+        response.text = "Service Unavailable!"
+        response.headers["Retry-After"] = str(self.retry_after)
+        return response
+
+    def __call__(self, serve, environ, start_response):
+        reason = self.try_acquire(environ)
+        if reason is not None:
+            return self.rejection()(environ, start_response)
+
+        try:
+            body = serve(environ, start_response)
+        except BaseException:
+            self.release()
+            raise
+
+        if isinstance(body, list):
+            self.release()
+            return body
+        return ReleasingBody(body, self.release)
@@ -1,15 +1,15 @@
 # api.py
-import os
 import inspect
-from webob import Request
-from parse import parse
-from requests import Session as RequestSession
-from wsgiadapter import WSGIAdapter as RequestWSGIAdapter
-from jinja2 import Environment, FileSystemLoader
-from whitenoise import WhiteNoise
-
-from .middleware import Middleware
+
+from .dispatch import DEFAULT_ALLOWED_METHODS, build_dispatch_table
+from .middleware import MiddlewareStack
+from .request import APP_ENVIRON_KEY, BadRequest, PayloadTooLarge, Request
 from .response import Response
+from .router import Router
+from .serialization import make_json_dumps
+
+# Jinja, WhiteNoise, asyncio, requests and the optional subsystems are
+# imported on first use, which keeps worker start-up cheap
 
 
 class OctopusAPI:
@@ -17,27 +17,117 @@ class OctopusAPI:
     # Entry Point of Application
     """
 
-    def __init__(self, templates_dir="templates", static_dir="static"):
+    def __init__(
+        self,
+        templates_dir="templates",
+        static_dir="static",
+        json_backend=None,
+        json_default=None,
+        template_cache=None,
+        auto_reload=True,
+        precompile_templates=False,
+        max_body_size=None,
+    ):
         self.routes = {}
+        self.router = Router()
 
-        # load templates dir
-        self.templates_env = Environment(
-            loader=FileSystemLoader(os.path.abspath(templates_dir))
-        )
+        # templates dir, with an optional bytecode cache ("memory" or a dir)
+        self.templates_dir = templates_dir
+        self.template_cache = template_cache
+        self.auto_reload = auto_reload
+        self._templates_env = None
+        if precompile_templates:
+            self.precompile_templates()
 
         self.exception_handler = None
 
-        self.whitenoise = WhiteNoise(self.wsgi_app, root=static_dir)
+        # bytes; routes can set their own with the `max_body_size` option
+        self.max_body_size = max_body_size
+
+        # stdlib json unless orjson/ujson is installed or a backend is named
+        self.json_dumps = make_json_dumps(json_backend, json_default)
+
+        self.static_dir = static_dir
+        self._whitenoise = None
+        # see enable_static_files()
+        self.static_files = None
+        # see static_url()
+        self._manifest = None
+
+        self.middleware = MiddlewareStack(self)
+
+        # see enable_metrics(), enable_profiling(), enable_admission_control()
+        # and enable_background_tasks()
+        self.metrics = None
+        self.profiler = None
+        self.admission = None
+        self.background_tasks = None
+
+        self._asgi = None
+
+    @property
+    def templates_env(self):
+        if self._templates_env is None:
+            from .templates import make_environment
 
-        self.middleware = Middleware(self)
+            self._templates_env = make_environment(
+                self.templates_dir,
+                template_cache=self.template_cache,
+                auto_reload=self.auto_reload,
+            )
+            self._templates_env.globals["static_url"] = self.static_url
+        return self._templates_env
+
+    @property
+    def whitenoise(self):
+        if self._whitenoise is None:
+            from whitenoise import WhiteNoise
+
+            from .static import is_hashed
+
+            self._whitenoise = WhiteNoise(
+                self.wsgi_app, root=self.static_dir, immutable_file_test=is_hashed
+            )
+        return self._whitenoise
+
+    @property
+    def asgi(self):
+        """
+        ASGI entry point sharing routes and middleware, e.g.
+        `uvicorn app:app.asgi`.
+        """
+
+        if self._asgi is None:
+            from .asgi import ASGIApp
+
+            self._asgi = ASGIApp(self)
+        return self._asgi
 
     def __call__(self, environ, start_response):
+        environ[APP_ENVIRON_KEY] = self
         path_info = environ["PATH_INFO"]
 
         if path_info.startswith("/static"):
             environ["PATH_INFO"] = path_info[len("/static") :]
+            if self.static_files is not None:
+                return self.static_files(environ, start_response)
             return self.whitenoise(environ, start_response)
 
+        if self.admission is not None:
+            return self.admission(self.handle_wsgi, environ, start_response)
+
+        return self.handle_wsgi(environ, start_response)
+
+    def handle_wsgi(self, environ, start_response):
+        if self.profiler is not None:
+            return self.profiler.profile(self.serve, environ, start_response)
+
+        return self.serve(environ, start_response)
+
+    def serve(self, environ, start_response):
+        if self.metrics is not None:
+            return self.metrics.instrument(self.middleware, environ, start_response)
+
         return self.middleware(environ, start_response)
 
     def wsgi_app(self, environ, start_response):
@@ -47,17 +137,29 @@ class OctopusAPI:
 
         return response(environ, start_response)
 
-    def add_route(self, path, handler, allowed_methods=None):
+    def add_route(
+        self, path, handler, allowed_methods=None, lifecycle="request", **options
+    ):
         assert path not in self.routes, "Duplicate Route - Such route already exists."
 
-        if allowed_methods is None:
-            allowed_methods = ["get", "post", "put", "delete"]
+        if allowed_methods is None and not inspect.isclass(handler):
+            allowed_methods = DEFAULT_ALLOWED_METHODS
+
+        handler_data = {
+            "path": path,
+            "handler": handler,
+            "allowed_methods": allowed_methods,
+            "methods": build_dispatch_table(handler, allowed_methods, lifecycle),
+            # per-route settings read by middleware, e.g. `cache_ttl`
+            "options": options,
+        }
 
-        self.routes[path] = {"handler": handler, "allowed_methods": allowed_methods}
+        self.routes[path] = handler_data
+        self.router.add(path, handler_data)
 
-    def route(self, path, allowed_methods=None):
+    def route(self, path, allowed_methods=None, lifecycle="request", **options):
         def wrapper(handler):
-            self.add_route(path, handler, allowed_methods)
+            self.add_route(path, handler, allowed_methods, lifecycle, **options)
             return handler
 
         return wrapper
@@ -67,54 +169,269 @@ class OctopusAPI:
         response.text = "Not Found!"
 
     def find_handler(self, request_path):
-        for path, handler_data in self.routes.items():
-            parse_result = parse(path, request_path)
-            if parse_result is not None:
-                return handler_data, parse_result.named
+        return self.router.match(request_path)
 
-        return None, None
+    def match_request(self, request):
+        request.environ.setdefault(APP_ENVIRON_KEY, self)
+        return request.route
+
+    def method_not_allowed_response(self, response, handler_data):
+        response.status_code = 405
+        response.headers["Allow"] = ", ".join(handler_data["methods"])
+        response.text = "Method Not Allowed!"
+
+    def bad_request_response(self, response):
+        response.status_code = 400
+        response.text = "Bad Request!"
+
+    def payload_too_large_response(self, response):
+        response.status_code = 413
+        response.text = "Payload Too Large!"
 
     def handle_request(self, request):
-        response = Response()
+        response = Response(json_dumps=self.json_dumps)
 
-        handler_data, kwargs = self.find_handler(request_path=request.path)
+        if self.metrics is not None:
+            self.metrics.mark(request.environ, "dispatch")
+        handler_data, kwargs = self.match_request(request)
+        if self.metrics is not None:
+            self.metrics.mark(request.environ, "routed")
 
         try:
             if handler_data is not None:
-                handler = handler_data["handler"]
-                allowed_methods = handler_data["allowed_methods"]
-                if inspect.isclass(handler):
-                    handler = getattr(handler(), request.method.lower(), None)
-                    if handler is None:
-                        raise AttributeError("Method not allowed", request.method)
+                method = handler_data["methods"].get(request.method)
+
+                if method is None:
+                    self.method_not_allowed_response(response, handler_data)
                 else:
-                    if request.method.lower() not in allowed_methods:
-                        raise AttributeError("Method not allowed", request.method)
+                    request.check_body_size()
+                    handler, is_async = method
+                    if is_async:
+                        import asyncio
+
+                        asyncio.run(handler(request, response, **kwargs))
+                    else:
+                        handler(request, response, **kwargs)
+            else:
+                self.default_response(response)
+        except PayloadTooLarge:
+            self.payload_too_large_response(response)
+        except BadRequest:
+            self.bad_request_response(response)
+        except Exception as e:
+            if self.exception_handler is None:
+                raise e
+            else:
+                self.exception_handler(request, response, e)
+
+        if self.metrics is not None:
+            self.metrics.mark(request.environ, "handled")
 
-                handler(request, response, **kwargs)
+        return response
+
+    async def handle_request_async(self, request):
+        response = Response(json_dumps=self.json_dumps)
+
+        if self.metrics is not None:
+            self.metrics.mark(request.environ, "dispatch")
+        handler_data, kwargs = self.match_request(request)
+        if self.metrics is not None:
+            self.metrics.mark(request.environ, "routed")
+
+        try:
+            if handler_data is not None:
+                method = handler_data["methods"].get(request.method)
+
+                if method is None:
+                    self.method_not_allowed_response(response, handler_data)
+                else:
+                    request.check_body_size()
+                    handler, is_async = method
+                    if is_async:
+                        await handler(request, response, **kwargs)
+                    else:
+                        await self.asgi.run_sync(handler, request, response, **kwargs)
             else:
                 self.default_response(response)
+        except PayloadTooLarge:
+            self.payload_too_large_response(response)
+        except BadRequest:
+            self.bad_request_response(response)
         except Exception as e:
             if self.exception_handler is None:
                 raise e
+            elif inspect.iscoroutinefunction(self.exception_handler):
+                await self.exception_handler(request, response, e)
             else:
                 self.exception_handler(request, response, e)
 
+        if self.metrics is not None:
+            self.metrics.mark(request.environ, "handled")
+
         return response
 
     def test_session(self, base_url="http://testserver"):
+        from requests import Session as RequestSession
+        from wsgiadapter import WSGIAdapter as RequestWSGIAdapter
+
         session = RequestSession()
         session.mount(prefix=base_url, adapter=RequestWSGIAdapter(self))
         return session
 
+    def test_client(self, base_url="http://testserver"):
+        from .testing import TestClient
+
+        return TestClient(self, base_url=base_url)
+
     def template(self, template_name, context=None):
         if context is None:
             context = {}
 
         return self.templates_env.get_template(template_name).render(**context)
 
+    def template_stream(self, template_name, context=None, chunk_size=8192):
+        if context is None:
+            context = {}
+
+        from .templates import encode_stream
+
+        template = self.templates_env.get_template(template_name)
+        return encode_stream(template.generate(**context), chunk_size)
+
+    def enable_metrics(self, path="/metrics", directory=None, **options):
+        """
+        Records per-route latency, in-flight requests and status codes and
+        serves them at `path` in Prometheus text format. Give every Gunicorn
+        worker the same `directory` to aggregate across processes.
+        """
+
+        from .metrics import CONTENT_TYPE, Metrics
+
+        self.metrics = Metrics(directory=directory, **options)
+        # recompile so middleware hooks are timed
+        self.middleware.compile()
+
+        def metrics_handler(req, resp):
+            resp.body = self.metrics.render().encode("UTF-8")
+            resp.content_type = CONTENT_TYPE
+
+        if path is not None:
+            self.add_route(path, metrics_handler, allowed_methods=["get"])
+
+        return self.metrics
+
+    def enable_profiling(
+        self, directory, sample_rate=0.001, slow_threshold=None, interval=0.005
+    ):
+        """
+        Profiles a `sample_rate` share of requests with cProfile and, given a
+        `slow_threshold` in seconds, samples the stacks of slower requests.
+        Results are written per route under `directory`.
+        """
+
+        from .profiling import Profiler
+
+        self.profiler = Profiler(
+            self,
+            directory,
+            sample_rate=sample_rate,
+            slow_threshold=slow_threshold,
+            interval=interval,
+        )
+        return self.profiler
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            from .static import load_manifest
+
+            self._manifest = load_manifest(self.static_dir)
+        return self._manifest
+
+    def static_url(self, name):
+        """
+        URL of the static file `name`, under its content-hashed name when
+        the manifest built by `build-manifest` lists one. Available in
+        templates as `{{ static_url("css/app.css") }}`.
+        """
+
+        return "/static/" + self.manifest.get(name, name)
+
+    def enable_admission_control(
+        self, max_concurrency=None, max_queue_time=None, retry_after=1, priorities=None
+    ):
+        """
+        Answers requests with 503 and `Retry-After` once this worker has
+        `max_concurrency` requests in flight, or once a request has waited
+        more than `max_queue_time` seconds behind the proxy. Routes pick a
+        class from `priorities` with their `priority` option.
+        """
+
+        from .admission import AdmissionControl
+
+        self.admission = AdmissionControl(
+            self,
+            max_concurrency=max_concurrency,
+            max_queue_time=max_queue_time,
+            retry_after=retry_after,
+            priorities=priorities,
+        )
+        return self.admission
+
+    def enable_background_tasks(
+        self, max_workers=4, max_queue=1000, drain_timeout=30.0
+    ):
+        """
+        Runs the work handlers pass to `response.background()` or
+        `app.background()` after the response, on `max_workers` threads (or
+        the event loop, for `async def` tasks under ASGI). At most
+        `max_queue` tasks wait at once, and pending ones get `drain_timeout`
+        seconds to finish when the worker shuts down.
+        """
+
+        from .background import BackgroundTasks
+
+        self.background_tasks = BackgroundTasks(
+            self,
+            max_workers=max_workers,
+            max_queue=max_queue,
+            drain_timeout=drain_timeout,
+        )
+        return self.background_tasks
+
+    def background(self, fn, *args, **kwargs):
+        """
+        Queues `fn(*args, **kwargs)` to run in the background now. Returns
+        False if the task was dropped because the queue is full.
+        """
+
+        if self.background_tasks is None:
+            self.enable_background_tasks()
+        return self.background_tasks.submit(fn, *args, **kwargs)
+
+    def enable_static_files(self, precompress=False, **options):
+        """
+        Serves `static_dir` with `StaticFiles` instead of WhiteNoise:
+        precompressed gzip/brotli variants, an in-memory cache for small
+        files, memory-mapped large files and immutable caching for
+        content-hashed names. `precompress=True` compresses the assets now;
+        `python -m web_pyoctopus compress-static` does it at build time.
+        """
+
+        from .static import StaticFiles
+
+        self.static_files = StaticFiles(
+            self.wsgi_app, self.static_dir, precompress=precompress, **options
+        )
+        return self.static_files
+
+    def precompile_templates(self):
+        from .templates import precompile
+
+        return precompile(self.templates_env)
+
     def add_exception_handler(self, exception_handler):
         self.exception_handler = exception_handler
 
-    def add_middleware(self, middleare_cls):
-        self.middleware.add(middleare_cls)
+    def add_middleware(self, middleare_cls, **options):
+        self.middleware.add(middleare_cls, **options)
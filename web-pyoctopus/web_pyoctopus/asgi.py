@@ -0,0 +1,253 @@
+# asgi.py
+import asyncio
+import functools
+import io
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .request import APP_ENVIRON_KEY, Request
+
+# bodies larger than this are spooled to a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+
+def build_environ(scope, body=None):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": str(client[0]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body or b""),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            key = name
+        else:
+            key = f"HTTP_{name}"
+
+        if key in environ:
+            value = f"{environ[key]},{value}"
+        environ[key] = value
+
+    if body is not None:
+        # the body has been read up front, so its length is known even when chunked
+        environ["CONTENT_LENGTH"] = str(len(body))
+
+    return environ
+
+
+class ASGIApp:
+    """
+    # ASGI Entry Point
+
+    Serves the routes, middleware chain and exception handler of an
+    `OctopusAPI` to an ASGI server. `async def` handlers are awaited on the
+    event loop, plain handlers run in a bounded thread pool.
+
+        uvicorn app:app.asgi
+    """
+
+    def __init__(self, app, max_workers=None):
+        self.app = app
+        self.max_workers = max_workers
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="octopus-asgi"
+            )
+        return self._executor
+
+    async def run_sync(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        if scope["type"] != "http":
+            raise NotImplementedError(
+                f"Unsupported ASGI scope type: {scope['type']}"
+            )
+
+        environ = build_environ(scope)
+        environ[APP_ENVIRON_KEY] = self.app
+
+        if environ["PATH_INFO"].startswith("/static"):
+            # static files are served by the WSGI side (WhiteNoise or StaticFiles)
+            environ["wsgi.input"], size = await self.read_body(receive)
+            environ["CONTENT_LENGTH"] = str(size)
+            await self.send_wsgi(self.app, environ, send)
+            return
+
+        admission = self.app.admission
+        if admission is None:
+            await self.serve(environ, receive, send)
+            return
+
+        if admission.try_acquire(environ) is not None:
+            rejection = admission.rejection()
+            await self.send_wsgi(rejection, environ, send, threaded=False)
+            return
+
+        try:
+            await self.serve(environ, receive, send)
+        finally:
+            admission.release()
+
+    async def serve(self, environ, receive, send):
+        # a body past the route's limit isn't read: the oversized length is
+        # kept, and the request is answered with 413
+        request = Request(environ)
+        max_body_size = request.max_body_size
+        declared = request.content_length
+        if max_body_size is not None and (declared or 0) > max_body_size:
+            size = declared
+        else:
+            environ["wsgi.input"], size = await self.read_body(receive, max_body_size)
+        environ["CONTENT_LENGTH"] = str(size)
+
+        metrics = self.app.metrics
+        if metrics is None:
+            response = await self.app.middleware.handle_request_async(request)
+            await self.send_wsgi(response, environ, send, threaded=False)
+            return
+
+        metrics.begin(environ)
+        status_code = 500
+        try:
+            response = await self.app.middleware.handle_request_async(request)
+            metrics.mark(environ, "responded")
+            status_code = response.status_code
+            await self.send_wsgi(response, environ, send, threaded=False)
+        finally:
+            metrics.end(environ, request, status_code)
+
+    async def read_body(self, receive, max_body_size=None):
+        """
+        Returns the body as a file and its size. Bodies larger than
+        SPOOL_SIZE go to a temporary file, and reading stops once
+        `max_body_size` is passed.
+        """
+
+        chunks = []
+        size = 0
+        spool = None
+        more_body = True
+
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunk = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            size += len(chunk)
+            if max_body_size is not None and size > max_body_size:
+                if spool is not None:
+                    spool.close()
+                return io.BytesIO(), size
+
+            if spool is None and size > SPOOL_SIZE:
+                spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+                spool.writelines(chunks)
+                chunks = []
+            if spool is None:
+                chunks.append(chunk)
+            else:
+                spool.write(chunk)
+
+        if spool is None:
+            return io.BytesIO(b"".join(chunks)), size
+
+        spool.seek(0)
+        return spool, size
+
+    async def send_wsgi(self, wsgi_app, environ, send, threaded=True):
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+
+        if threaded:
+            iterable = await self.run_sync(wsgi_app, environ, start_response)
+        else:
+            iterable = wsgi_app(environ, start_response)
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": started["status"],
+                "headers": started["headers"],
+            }
+        )
+
+        async def send_body(body, more_body=False):
+            await send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+
+        try:
+            if isinstance(iterable, (list, tuple)):
+                await send_body(b"".join(iterable))
+                return
+
+            if getattr(iterable, "is_async", False):
+                async for chunk in iterable:
+                    await send_body(chunk, more_body=True)
+            else:
+                # pull each chunk in the pool so slow generators don't block the loop
+                iterator = iter(iterable)
+                while True:
+                    chunk = await self.run_sync(next, iterator, None)
+                    if chunk is None:
+                        break
+                    await send_body(chunk, more_body=True)
+
+            await send_body(b"")
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.app.background_tasks is not None:
+                    await self.app.background_tasks.drain_async()
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                    self._executor = None
+                await send({"type": "lifespan.shutdown.complete"})
+                return
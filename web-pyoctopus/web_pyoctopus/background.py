@@ -0,0 +1,220 @@
+# background.py
+import asyncio
+import inspect
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from .request import APP_ENVIRON_KEY
+
+
+logger = logging.getLogger(__name__)
+
+
+def task_name(fn):
+    return getattr(fn, "__qualname__", None) or repr(fn)
+
+
+def run_inline(fn, args, kwargs):
+    if inspect.iscoroutinefunction(fn):
+        asyncio.run(fn(*args, **kwargs))
+    else:
+        fn(*args, **kwargs)
+
+
+class BackgroundTasks:
+    """
+    # Work Run After the Response
+
+    Runs tasks on a pool of `max_workers` threads, or, for `async def` tasks
+    submitted from an event loop (ASGI), as tasks on that loop. At most
+    `max_queue` tasks are pending at once; past that a task is dropped,
+    logged and counted, so a burst of slow work can't grow memory without
+    bound. On shutdown (interpreter exit, or the ASGI lifespan shutdown)
+    pending tasks get up to `drain_timeout` seconds to finish.
+
+    With metrics enabled, `octopus_background_queue_depth` tracks pending
+    tasks, `octopus_background_task_seconds` their duration, and
+    `octopus_background_tasks_total` their outcome.
+    """
+
+    def __init__(self, app, max_workers=4, max_queue=1000, drain_timeout=30.0):
+        self.app = app
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.drain_timeout = drain_timeout
+
+        self.pending = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        # tasks running on an event loop, kept so they can be awaited on drain
+        self.loop_tasks = set()
+
+        self._executor = None
+        # ThreadPoolExecutor joins its workers from a threading exit hook,
+        # ahead of atexit; hooks run last registered first, so this drains
+        # (and cancels what is left) before that join
+        threading._register_atexit(self.drain)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="octopus-background"
+            )
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues `fn(*args, **kwargs)`. Returns False when the task is dropped
+        because the queue is full or the runner is shutting down.
+        """
+
+        with self.condition:
+            accepted = not self.closed and self.pending < self.max_queue
+            if accepted:
+                self.pending += 1
+            pending = self.pending
+
+        metrics = self.app.metrics
+        if not accepted:
+            self.drop(fn)
+            return False
+
+        if metrics is not None:
+            metrics.set_gauge("octopus_background_queue_depth", pending)
+
+        if inspect.iscoroutinefunction(fn):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                task = loop.create_task(self.run_async(fn, args, kwargs))
+                self.loop_tasks.add(task)
+                task.add_done_callback(self.loop_tasks.discard)
+                return True
+
+        try:
+            self.executor.submit(self.run, fn, args, kwargs)
+        except RuntimeError:
+            # the executor is shutting down along with the interpreter
+            with self.condition:
+                self.pending -= 1
+                self.condition.notify_all()
+            self.drop(fn)
+            return False
+        return True
+
+    def drop(self, fn):
+        logger.error("Background task %s dropped: queue closed or full", task_name(fn))
+        metrics = self.app.metrics
+        if metrics is not None:
+            metrics.inc(
+                "octopus_background_tasks_total",
+                (("task", task_name(fn)), ("outcome", "dropped")),
+            )
+
+    def run(self, fn, args, kwargs):
+        start = perf_counter()
+        outcome = "done"
+        try:
+            run_inline(fn, args, kwargs)
+        except Exception:
+            logger.exception("Background task %s failed", task_name(fn))
+            outcome = "failed"
+        finally:
+            self.finish(fn, outcome, perf_counter() - start)
+
+    async def run_async(self, fn, args, kwargs):
+        start = perf_counter()
+        outcome = "done"
+        try:
+            await fn(*args, **kwargs)
+        except Exception:
+            logger.exception("Background task %s failed", task_name(fn))
+            outcome = "failed"
+        finally:
+            self.finish(fn, outcome, perf_counter() - start)
+
+    def finish(self, fn, outcome, duration):
+        with self.condition:
+            self.pending -= 1
+            pending = self.pending
+            self.condition.notify_all()
+
+        metrics = self.app.metrics
+        if metrics is not None:
+            labels = (("task", task_name(fn)),)
+            metrics.set_gauge("octopus_background_queue_depth", pending)
+            metrics.observe("octopus_background_task_seconds", duration, labels)
+            metrics.inc(
+                "octopus_background_tasks_total", labels + (("outcome", outcome),)
+            )
+
+    def drain(self, timeout=None):
+        """
+        Stops taking tasks and waits up to `timeout` seconds (default
+        `drain_timeout`) for the pending ones. Returns True if all finished.
+        """
+
+        timeout = self.drain_timeout if timeout is None else timeout
+        with self.condition:
+            self.closed = True
+            drained = self.condition.wait_for(lambda: self.pending == 0, timeout)
+
+        if self._executor is not None:
+            # tasks still queued past the timeout are not started
+            self._executor.shutdown(wait=drained, cancel_futures=not drained)
+            self._executor = None
+        return drained
+
+    async def drain_async(self, timeout=None):
+        """
+        `drain` for an event loop: waits for the tasks on this loop too.
+        """
+
+        timeout = self.drain_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        self.closed = True
+        if self.loop_tasks:
+            await asyncio.wait(set(self.loop_tasks), timeout=timeout)
+        remaining = max(deadline - loop.time(), 0.0)
+        return await loop.run_in_executor(None, self.drain, remaining)
+
+
+class TasksBody:
+    """
+    # WSGI Iterable Starting Background Tasks When Closed
+
+    The server closes the body once it has sent it, so the tasks of a
+    response never delay it.
+    """
+
+    def __init__(self, body, tasks, environ):
+        self.body = body
+        self.tasks = tasks
+        self.environ = environ
+        self.is_async = getattr(body, "is_async", False)
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def __aiter__(self):
+        return self.body.__aiter__()
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            app = self.environ.get(APP_ENVIRON_KEY)
+            for fn, args, kwargs in self.tasks:
+                if app is None:
+                    # a response served outside an OctopusAPI
+                    run_inline(fn, args, kwargs)
+                else:
+                    app.background(fn, *args, **kwargs)
@@ -0,0 +1,257 @@
+# cache.py
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .middleware import Middleware
+from .response import Response
+
+
+class CacheBackend:
+    """
+    # Storage Interface for CacheMiddleware
+
+    Entries are plain dicts of picklable values, so a backend may keep them
+    in memory, on disk or anywhere else shared between worker processes.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, entry, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """
+    # Bounded In-Process LRU with Per-Entry TTLs
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+
+            expires_at, entry = item
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, entry)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class FileCache(CacheBackend):
+    """
+    # On-Disk Cache Shared by Every Worker Using the Same Directory
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(
+            self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest()
+        )
+
+    def get(self, key):
+        path = self.path(key)
+
+        try:
+            with open(path, "rb") as f:
+                expires_at, entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if expires_at <= time.time():
+            self.delete(key)
+            return None
+
+        return entry
+
+    def set(self, key, entry, ttl):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((time.time() + ttl, entry), f)
+            # atomic, so other workers never read a half-written entry
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def etag_for(body):
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match.strip() == "*":
+        return True
+
+    # If-None-Match uses the weak comparison
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+class CacheMiddleware(Middleware):
+    """
+    # Response Cache
+
+    Caches finished 200 responses to GET and HEAD requests for routes
+    declared with `cache_ttl` (seconds), or for every route when a default
+    `ttl` is given. Entries are keyed on the method, path, query string and
+    the `vary` request headers, and carry a strong ETag; a matching
+    `If-None-Match` is answered with 304 without running the handler.
+    Responses setting a cookie are never stored, as they belong to one
+    client.
+
+        app.add_middleware(CacheMiddleware, backend=FileCache("/tmp/octopus"))
+
+        @app.route("/reports", cache_ttl=60)
+        def reports(req, resp):
+            ...
+    """
+
+    methods = ("GET", "HEAD")
+
+    def __init__(self, app, backend=None, ttl=None, vary=()):
+        super().__init__(app)
+        self.backend = backend if backend is not None else MemoryCache()
+        self.ttl = ttl
+        self.vary = tuple(vary)
+
+    def handle_request(self, request):
+        ttl = self.route_ttl(request)
+        if not ttl:
+            return self.app.handle_request(request)
+
+        key = self.cache_key(request)
+        entry = self.backend.get(key)
+
+        if entry is None:
+            response = self.app.handle_request(request)
+            entry = self.store(key, response, ttl)
+            if entry is None:
+                return response
+            return self.fresh_response(request, response, entry)
+
+        return self.cached_response(request, entry)
+
+    async def handle_request_async(self, request):
+        ttl = self.route_ttl(request)
+        if not ttl:
+            return await self.app.handle_request_async(request)
+
+        key = self.cache_key(request)
+        entry = self.backend.get(key)
+
+        if entry is None:
+            response = await self.app.handle_request_async(request)
+            entry = self.store(key, response, ttl)
+            if entry is None:
+                return response
+            return self.fresh_response(request, response, entry)
+
+        return self.cached_response(request, entry)
+
+    def route_ttl(self, request):
+        if request.method not in self.methods:
+            return None
+        return request.route_options.get("cache_ttl", self.ttl)
+
+    def cache_key(self, request):
+        parts = [request.method, request.path, request.query_string]
+        parts.extend(request.headers.get(name, "") for name in self.vary)
+        return "\n".join(parts)
+
+    def store(self, key, response, ttl):
+        cacheable = (
+            response.status_code == 200
+            and response.stream is None
+            and response.webob is None
+            and not any(name.lower() == "set-cookie" for name in response.headers)
+        )
+        if not cacheable:
+            return None
+
+        response.set_body_and_content_type()
+        body = response.body
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+
+        entry = {
+            "body": body,
+            "content_type": response.content_type,
+            "headers": dict(response.headers),
+            "etag": etag_for(body),
+        }
+        self.backend.set(key, entry, ttl)
+
+        return entry
+
+    def fresh_response(self, request, response, entry):
+        cached = self.cached_response(request, entry)
+        # the handler ran, so its background tasks still have to
+        cached.tasks = response.tasks
+        return cached
+
+    def cached_response(self, request, entry):
+        response = Response()
+        response.headers.update(entry["headers"])
+        response.headers["ETag"] = entry["etag"]
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, entry["etag"]):
+            response.status_code = 304
+            return response
+
+        response.body = entry["body"]
+        response.content_type = entry["content_type"]
+        return response
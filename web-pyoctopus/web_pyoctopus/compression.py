@@ -0,0 +1,194 @@
+# compression.py
+import gzip
+import hashlib
+import zlib
+
+from .cache import MemoryCache
+from .middleware import Middleware
+from .response import BODILESS_STATUSES, encode_chunk, read_blocks
+from .static import accepted_encodings, brotli
+
+
+# content types worth compressing; images, archives, fonts and video are not
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/xhtml+xml",
+    "image/svg+xml",
+)
+COMPRESSIBLE_SUFFIXES = ("+json", "+xml")
+
+DEFAULT_LEVELS = {"br": 4, "gzip": 6}
+
+
+def compressible(content_type):
+    if not content_type:
+        # the response default, text/html
+        return True
+    content_type = content_type.split(";", 1)[0].strip().lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) or content_type.endswith(
+        COMPRESSIBLE_SUFFIXES
+    )
+
+
+def compress(data, encoding, level):
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, level, mtime=0)
+
+
+def compressor(encoding, level):
+    """
+    Returns `(compress, finish)` for compressing a stream chunk by chunk;
+    `compress` flushes, so every chunk reaches the client as it comes.
+    """
+
+    if encoding == "br":
+        stream = brotli.Compressor(quality=level)
+
+        def compress_chunk(data):
+            return stream.process(data) + stream.flush()
+
+        return compress_chunk, stream.finish
+
+    # wbits=31 writes a gzip header and trailer
+    stream = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress_chunk(data):
+        return stream.compress(data) + stream.flush(zlib.Z_SYNC_FLUSH)
+
+    return compress_chunk, stream.flush
+
+
+def compress_chunks(stream, encoding, level):
+    compress_chunk, finish = compressor(encoding, level)
+    chunks = read_blocks(stream) if hasattr(stream, "read") else stream
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield compress_chunk(encode_chunk(chunk))
+        yield finish()
+    finally:
+        if hasattr(stream, "close"):
+            stream.close()
+
+
+async def compress_chunks_async(chunks, encoding, level):
+    compress_chunk, finish = compressor(encoding, level)
+    async for chunk in chunks:
+        if chunk:
+            yield compress_chunk(encode_chunk(chunk))
+    yield finish()
+
+
+class CompressionMiddleware(Middleware):
+    """
+    # Response Compression
+
+    Compresses responses with brotli (when installed) or gzip, as the
+    client's `Accept-Encoding` allows. Bodies under `min_size` bytes and
+    content types that are compressed already are left alone; streamed
+    bodies are compressed chunk by chunk. Routes can set their own
+    `compression_level`, or turn compression off with `compress=False`.
+
+    With `cache=True` (or a cache backend), compressed bodies are kept by
+    ETag or content hash, so identical payloads, such as those served by
+    `CacheMiddleware`, are compressed once. Add this middleware after
+    `CacheMiddleware` so it runs outside it.
+
+        app.add_middleware(CacheMiddleware)
+        app.add_middleware(CompressionMiddleware, cache=True)
+    """
+
+    def __init__(self, app, min_size=500, levels=None, cache=None, cache_ttl=3600):
+        super().__init__(app)
+        self.min_size = min_size
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self.cache = MemoryCache() if cache is True else cache or None
+        self.cache_ttl = cache_ttl
+
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+
+    def choose_encoding(self, request):
+        accept_encoding = request.headers.get("accept-encoding")
+        if not accept_encoding:
+            return None
+
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in self.encodings:
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def process_response(self, req, resp):
+        if (
+            resp.webob is not None
+            or resp.status_code < 200
+            or resp.status_code in BODILESS_STATUSES
+            or any(name.lower() == "content-encoding" for name in resp.headers)
+        ):
+            return
+
+        options = req.route_options
+        if not options.get("compress", True):
+            return
+
+        if resp.stream is None:
+            resp.set_body_and_content_type()
+        if not compressible(resp.content_type):
+            return
+
+        # whether compressed or not, the response depends on the header
+        self.add_vary(resp)
+        encoding = self.choose_encoding(req)
+        if encoding is None:
+            return
+
+        level = options.get("compression_level", self.levels[encoding])
+
+        if resp.stream is not None:
+            if hasattr(resp.stream, "__aiter__"):
+                resp.stream = compress_chunks_async(resp.stream, encoding, level)
+            else:
+                resp.stream = compress_chunks(resp.stream, encoding, level)
+        else:
+            body = resp.body
+            if isinstance(body, str):
+                body = body.encode("UTF-8")
+            if len(body) < self.min_size:
+                return
+            resp.body = self.compress_body(resp, body, encoding, level)
+            # or serving the response would serialise them over the body again
+            resp.json = resp.html = resp.text = None
+
+        resp.headers["Content-Encoding"] = encoding
+
+        # the compressed body is a different representation of the same one
+        etag = resp.headers.get("ETag")
+        if etag is not None and not etag.startswith("W/"):
+            resp.headers["ETag"] = f"W/{etag}"
+
+    def compress_body(self, resp, body, encoding, level):
+        if self.cache is None:
+            return compress(body, encoding, level)
+
+        # a strong ETag names exactly these bytes; otherwise hash them
+        digest = resp.headers.get("ETag")
+        if digest is None or digest.startswith("W/"):
+            digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        key = f"{encoding}:{level}:{digest}"
+
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = compress(body, encoding, level)
+            self.cache.set(key, compressed, self.cache_ttl)
+        return compressed
+
+    def add_vary(self, resp):
+        vary = resp.headers.get("Vary")
+        if vary is None:
+            resp.headers["Vary"] = "Accept-Encoding"
+        elif "accept-encoding" not in vary.lower():
+            resp.headers["Vary"] = f"{vary}, Accept-Encoding"
@@ -0,0 +1,74 @@
+# dispatch.py
+import inspect
+import threading
+
+
+HTTP_METHODS = ("get", "head", "post", "put", "patch", "delete", "options")
+
+DEFAULT_ALLOWED_METHODS = ["get", "post", "put", "delete"]
+
+# how long a class-based resource instance lives
+LIFECYCLES = ("request", "thread", "process")
+
+
+def per_request(resource_cls, func):
+    def call(*args, **kwargs):
+        return func(resource_cls(), *args, **kwargs)
+
+    return call
+
+
+def per_thread(resource_cls, func, local):
+    def call(*args, **kwargs):
+        try:
+            instance = local.instance
+        except AttributeError:
+            instance = local.instance = resource_cls()
+        return func(instance, *args, **kwargs)
+
+    return call
+
+
+def build_dispatch_table(handler, allowed_methods=None, lifecycle="request"):
+    """
+    Maps each allowed HTTP method (upper case, as in REQUEST_METHOD) to a
+    `(callable, is_async)` pair, so a request is dispatched with one dict
+    lookup. Resource classes get their instance from `lifecycle`: a new one
+    per request, one per thread, or a single one for the process.
+    """
+
+    if lifecycle not in LIFECYCLES:
+        raise ValueError(
+            f"Unknown lifecycle {lifecycle!r}, expected one of {LIFECYCLES}"
+        )
+
+    if not inspect.isclass(handler):
+        if allowed_methods is None:
+            allowed_methods = DEFAULT_ALLOWED_METHODS
+
+        is_async = inspect.iscoroutinefunction(handler)
+        return {method.upper(): (handler, is_async) for method in allowed_methods}
+
+    if lifecycle == "process":
+        instance = handler()
+    elif lifecycle == "thread":
+        local = threading.local()
+
+    table = {}
+    for method in HTTP_METHODS:
+        func = getattr(handler, method, None)
+        if func is None:
+            continue
+        if allowed_methods is not None and method not in allowed_methods:
+            continue
+
+        if lifecycle == "process":
+            call = getattr(instance, method)
+        elif lifecycle == "thread":
+            call = per_thread(handler, func, local)
+        else:
+            call = per_request(handler, func)
+
+        table[method.upper()] = (call, inspect.iscoroutinefunction(func))
+
+    return table
@@ -0,0 +1,298 @@
+# loadtest.py
+import http.client
+import importlib
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from time import perf_counter
+
+from .testing import make_environ
+
+
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+def load_app(target):
+    """
+    Imports `module:attribute`, e.g. "app:app", the way Gunicorn does.
+    """
+
+    module_name, _, attribute = target.partition(":")
+    sys.path.insert(0, os.getcwd())
+    app = importlib.import_module(module_name)
+    for name in (attribute or "app").split("."):
+        app = getattr(app, name)
+    return app
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * percent / 100), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def count_error(errors, path, status):
+    statuses = errors.setdefault(path, {})
+    statuses[status] = statuses.get(status, 0) + 1
+
+
+def is_error(status):
+    # anything but 2xx and 3xx
+    return not 200 <= status < 400
+
+
+def wsgi_worker(app, paths, requests, method="GET"):
+    """
+    Calls the WSGI app directly `requests` times, cycling through `paths`.
+    Returns {path: [latency in seconds, ...]} for successful responses and
+    {path: {status: count}} for the others, with "exception" standing for
+    requests that raised.
+    """
+
+    latencies = {path: [] for path in paths}
+    errors = {}
+    environs = [(path, make_environ(method, path)) for path in paths]
+    status = [0]
+
+    def start_response(status_line, headers, exc_info=None):
+        status[0] = int(status_line[:3])
+
+    for i in range(requests):
+        path, environ = environs[i % len(environs)]
+        start = perf_counter()
+        try:
+            body = app(dict(environ), start_response)
+            for _ in body:
+                pass
+            if hasattr(body, "close"):
+                body.close()
+        except Exception:
+            count_error(errors, path, "exception")
+            continue
+        if is_error(status[0]):
+            count_error(errors, path, str(status[0]))
+            continue
+        latencies[path].append(perf_counter() - start)
+
+    return latencies, errors
+
+
+def http_worker(host, port, paths, requests, method="GET"):
+    """
+    Same as wsgi_worker, over one keep-alive HTTP connection.
+    """
+
+    latencies = {path: [] for path in paths}
+    errors = {}
+    connection = http.client.HTTPConnection(host, port)
+
+    for i in range(requests):
+        path = paths[i % len(paths)]
+        start = perf_counter()
+        try:
+            connection.request(method, path)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            count_error(errors, path, "exception")
+            connection.close()
+            connection = http.client.HTTPConnection(host, port)
+            continue
+        if is_error(response.status):
+            count_error(errors, path, str(response.status))
+            continue
+        latencies[path].append(perf_counter() - start)
+
+    connection.close()
+    return latencies, errors
+
+
+def run_threads(worker, args, threads):
+    results = [None] * threads
+
+    def run(index):
+        results[index] = worker(*args)
+
+    pool = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    return results
+
+
+def process_main(worker_name, worker_args, threads, queue):
+    worker_args = list(worker_args)
+    if worker_name == "wsgi":
+        worker, worker_args[0] = wsgi_worker, load_app(worker_args[0])
+    else:
+        worker = http_worker
+    queue.put(run_threads(worker, worker_args, threads))
+
+
+def merge(results):
+    latencies, errors = {}, {}
+    for worker_latencies, worker_errors in results:
+        for path, values in worker_latencies.items():
+            latencies.setdefault(path, []).extend(values)
+        for path, statuses in worker_errors.items():
+            for status, count in statuses.items():
+                merged = errors.setdefault(path, {})
+                merged[status] = merged.get(status, 0) + count
+    return latencies, errors
+
+
+def summarise(latencies, errors, elapsed):
+    """
+    Per-route request counts, error statuses and throughput; latency
+    percentiles cover successful (2xx/3xx) responses only.
+    """
+
+    routes = {}
+    total = total_errors = 0
+
+    for path, values in latencies.items():
+        values.sort()
+        statuses = errors.get(path, {})
+        route_errors = sum(statuses.values())
+        requests = len(values) + route_errors
+        total += requests
+        total_errors += route_errors
+        routes[path] = {
+            "requests": requests,
+            "errors": route_errors,
+            "error_statuses": statuses,
+            "throughput": requests / elapsed if elapsed else 0.0,
+            "mean_ms": sum(values) / len(values) * 1e3 if values else 0.0,
+            **{f"p{p:g}_ms": percentile(values, p) * 1e3 for p in PERCENTILES},
+        }
+
+    return {
+        "requests": total,
+        "errors": total_errors,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed else 0.0,
+        "routes": routes,
+    }
+
+
+def run_load(app, paths, requests=10000, threads=4, processes=1, method="GET"):
+    """
+    Sends `requests` requests per thread spread over `paths`, calling `app`
+    as a WSGI callable from `threads` threads in each of `processes`
+    processes. With more than one process `app` must be an import string
+    such as "app:app" so every process can load it.
+    """
+
+    if isinstance(app, str) and processes == 1:
+        app = load_app(app)
+
+    return run_workers("wsgi", (app, paths, requests, method), threads, processes)
+
+
+def run_http_load(
+    host, port, paths, requests=10000, threads=4, processes=1, method="GET"
+):
+    return run_workers(
+        "http", (host, port, paths, requests, method), threads, processes
+    )
+
+
+def run_workers(worker_name, worker_args, threads, processes):
+    start = perf_counter()
+
+    if processes == 1:
+        worker = wsgi_worker if worker_name == "wsgi" else http_worker
+        results = run_threads(worker, worker_args, threads)
+    else:
+        queue = multiprocessing.Queue()
+        pool = [
+            multiprocessing.Process(
+                target=process_main, args=(worker_name, worker_args, threads, queue)
+            )
+            for _ in range(processes)
+        ]
+        for process in pool:
+            process.start()
+        results = []
+        for _ in pool:
+            results.extend(queue.get())
+        for process in pool:
+            process.join()
+
+    elapsed = perf_counter() - start
+    return summarise(*merge(results), elapsed)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_gunicorn(target, workers=1, port=None, timeout=10.0):
+    """
+    Starts Gunicorn on loopback serving `target` ("app:app") and waits until
+    it accepts connections. Returns the process and its port.
+    """
+
+    port = port or free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            target,
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ]
+    )
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError(f"Gunicorn did not start serving {target} on port {port}")
+
+
+def format_report(report):
+    lines = [
+        f"{report['requests']} requests in {report['elapsed']:.2f}s, "
+        f"{report['throughput']:.0f} req/s, {report['errors']} errors",
+        "",
+        f"{'route':<30} {'req/s':>9} {'errors':>7} {'mean':>8} {'p50':>8} "
+        f"{'p95':>8} {'p99':>8} {'p99.9':>8}  (ms)",
+    ]
+
+    for path, route in report["routes"].items():
+        lines.append(
+            f"{path:<30} {route['throughput']:>9.0f} {route['errors']:>7} "
+            f"{route['mean_ms']:>8.3f} {route['p50_ms']:>8.3f} "
+            f"{route['p95_ms']:>8.3f} {route['p99_ms']:>8.3f} "
+            f"{route['p99.9_ms']:>8.3f}"
+        )
+        if route["error_statuses"]:
+            statuses = ", ".join(
+                f"{status}: {count}"
+                for status, count in sorted(route["error_statuses"].items())
+            )
+            lines.append(f"{'':<30} errors by status: {statuses}")
+
+    return "\n".join(lines)
@@ -0,0 +1,415 @@
+# metrics.py
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from time import perf_counter
+
+from .request import Request
+
+
+# latency buckets in seconds, from half a millisecond to ten seconds
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# environ key holding the perf_counter() marks taken while serving a request
+MARKS_ENVIRON_KEY = "web_pyoctopus.metrics_marks"
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# counters and histograms of exited workers, see mark_process_dead()
+ARCHIVE_NAME = "archive.json"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ""
+
+    formatted = ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs)
+    return "{" + formatted + "}"
+
+
+def format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def snapshot_pid(path):
+    """
+    The worker pid a `<pid>.json` file belongs to, or None for the archive.
+    """
+
+    name = os.path.basename(path)[: -len(".json")]
+    return int(name) if name.isdigit() else None
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(path, snapshot):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+
+
+def merge_snapshots(snapshots):
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot["gauges"]:
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, counts, total, count in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+
+    return counters, gauges, histograms
+
+
+def mark_process_dead(directory, pid):
+    """
+    Folds the counters and histograms of the exited worker `pid` into the
+    archive file and removes its own file, dropping its gauges, so the
+    directory doesn't grow as Gunicorn recycles workers. Call it from the
+    `child_exit` server hook.
+    """
+
+    path = os.path.join(directory, f"{pid}.json")
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        return
+
+    archive_path = os.path.join(directory, ARCHIVE_NAME)
+    snapshots = [{**snapshot, "gauges": []}]
+    archive = read_snapshot(archive_path)
+    if archive is not None:
+        snapshots.append(archive)
+
+    counters, _, histograms = merge_snapshots(snapshots)
+    write_snapshot(
+        archive_path,
+        {
+            "counters": [[n, l, v] for (n, l), v in counters.items()],
+            "gauges": [],
+            "histograms": [
+                [n, l, counts, total, count]
+                for (n, l), (counts, total, count) in histograms.items()
+            ],
+        },
+    )
+    os.remove(path)
+
+
+class Metrics:
+    """
+    # Request Metrics in Prometheus Text Format
+
+    Counters, gauges and histograms keyed by name and labels. Requests are
+    timed in four phases (routing, middleware, handler and serialisation)
+    and labelled with their route template.
+
+    With a `directory`, every worker process flushes its values to its own
+    file there at most every `flush_interval` seconds, and `render()` adds up
+    the files of all workers, so any worker can answer the scrape. Gauges
+    of workers that have exited are left out; `mark_process_dead` archives
+    the rest of their file.
+    """
+
+    def __init__(self, directory=None, buckets=DEFAULT_BUCKETS, flush_interval=1.0):
+        self.directory = directory
+        self.buckets = tuple(buckets)
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+
+        self.descriptions = {}
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+        self.describe("octopus_requests_in_flight", "gauge", "Requests being served.")
+        self.describe(
+            "octopus_responses_total", "counter", "Responses by route and status."
+        )
+        self.describe(
+            "octopus_request_duration_seconds",
+            "histogram",
+            "Time spent serving a request.",
+        )
+        self.describe(
+            "octopus_request_phase_seconds",
+            "histogram",
+            "Time spent in each phase of serving a request.",
+        )
+        self.describe(
+            "octopus_middleware_seconds",
+            "histogram",
+            "Time spent in each middleware hook.",
+        )
+        self.describe(
+            "octopus_admission_total",
+            "counter",
+            "Admission control decisions by reason and priority.",
+        )
+        self.describe(
+            "octopus_admission_in_flight",
+            "gauge",
+            "Requests holding an admission slot in this worker.",
+        )
+        self.describe(
+            "octopus_queue_time_seconds",
+            "histogram",
+            "Time requests waited in the proxy queue (X-Request-Start).",
+        )
+        self.describe(
+            "octopus_rate_limited_total",
+            "counter",
+            "Requests refused by the rate limiter, by route.",
+        )
+        self.describe(
+            "octopus_background_queue_depth",
+            "gauge",
+            "Background tasks queued or running in this worker.",
+        )
+        self.describe(
+            "octopus_background_task_seconds",
+            "histogram",
+            "Time spent running each background task.",
+        )
+        self.describe(
+            "octopus_background_tasks_total",
+            "counter",
+            "Background tasks by task and outcome (done, failed or dropped).",
+        )
+
+        self.last_flush = 0.0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def describe(self, name, kind, description):
+        self.descriptions[name] = (kind, description)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, labels=()):
+        with self.lock:
+            self.gauges[(name, tuple(labels))] = value
+
+    def add_gauge(self, name, value, labels=()):
+        key = (name, tuple(labels))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        with self.lock:
+            self._observe((name, tuple(labels)), value)
+
+    def _observe(self, key, value):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self.histograms[key] = histogram
+
+        counts = histogram[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+
+        histogram[1] += value
+        histogram[2] += 1
+
+    # request timing
+
+    def mark(self, environ, name):
+        marks = environ.get(MARKS_ENVIRON_KEY)
+        if marks is not None:
+            marks[name] = perf_counter()
+
+    def begin(self, environ):
+        environ[MARKS_ENVIRON_KEY] = {"start": perf_counter()}
+        self.add_gauge("octopus_requests_in_flight", 1)
+
+    def end(self, environ, request, status_code):
+        end = perf_counter()
+        marks = environ.get(MARKS_ENVIRON_KEY, {})
+        start = marks.get("start", end)
+        responded = marks.get("responded", end)
+
+        # routing and handler marks are missing when middleware short-circuits
+        dispatch = marks.get("dispatch")
+        if dispatch is None:
+            routing = handler = 0.0
+        else:
+            routed = marks.get("routed", dispatch)
+            handled = marks.get("handled", routed)
+            routing = routed - dispatch
+            handler = handled - routed
+
+        phases = (
+            ("routing", routing),
+            ("middleware", max(responded - start - routing - handler, 0.0)),
+            ("handler", handler),
+            ("serialisation", end - responded),
+        )
+
+        handler_data = request.route[0]
+        route = UNMATCHED_ROUTE if handler_data is None else handler_data["path"]
+        labels = (("route", route),)
+
+        with self.lock:
+            in_flight = ("octopus_requests_in_flight", ())
+            self.gauges[in_flight] = self.gauges.get(in_flight, 0) - 1
+
+            status = ("octopus_responses_total", labels + (("status", status_code),))
+            self.counters[status] = self.counters.get(status, 0) + 1
+
+            self._observe(("octopus_request_duration_seconds", labels), end - start)
+            for phase, seconds in phases:
+                self._observe(
+                    ("octopus_request_phase_seconds", labels + (("phase", phase),)),
+                    seconds,
+                )
+
+        if self.directory is not None:
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def instrument(self, app, environ, start_response):
+        """
+        Serves a WSGI request through `app` (the middleware entry point),
+        taking the marks that split it into phases.
+        """
+
+        self.begin(environ)
+        request = Request(environ)
+        status_code = 500
+
+        try:
+            response = app.handle_request(request)
+            self.mark(environ, "responded")
+            status_code = response.status_code
+            return response(environ, start_response)
+        finally:
+            self.end(environ, request, status_code)
+
+    # export
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [[n, l, v] for (n, l), v in self.counters.items()],
+                "gauges": [[n, l, v] for (n, l), v in self.gauges.items()],
+                "histograms": [
+                    [n, l, list(counts), total, count]
+                    for (n, l), (counts, total, count) in self.histograms.items()
+                ],
+            }
+
+    def flush(self):
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        write_snapshot(path, self.snapshot())
+
+        self.last_flush = time.monotonic()
+
+    def collect(self):
+        snapshots = [self.snapshot()]
+
+        if self.directory is not None:
+            own = os.path.join(self.directory, f"{os.getpid()}.json")
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                if path == own:
+                    continue
+                snapshot = read_snapshot(path)
+                if snapshot is None:
+                    continue
+                pid = snapshot_pid(path)
+                if pid is not None and not pid_alive(pid):
+                    # a dead worker's requests are no longer in flight
+                    snapshot["gauges"] = []
+                snapshots.append(snapshot)
+
+        return merge_snapshots(snapshots)
+
+    def render(self):
+        counters, gauges, histograms = self.collect()
+        lines = []
+        described = set()
+
+        def header(name):
+            if name in described or name not in self.descriptions:
+                return
+            described.add(name)
+            kind, description = self.descriptions[name]
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for values in (counters, gauges):
+            for (name, labels), value in sorted(values.items(), key=str):
+                header(name)
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+        for (name, labels), (counts, total, count) in sorted(
+            histograms.items(), key=str
+        ):
+            header(name)
+            cumulative = 0
+            bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                le = format_labels(labels, [("le", bound)])
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
@@ -1,5 +1,8 @@
 # middleware
-from webob import Request
+from time import perf_counter
+
+from .request import Request
+from .response import Response
 
 
 class Middleware:
@@ -11,18 +14,181 @@ class Middleware:
         response = self.app.handle_request(request)
         return response(environ, start_response)
 
-    def add(self, middleare_cls):
-        self.app = middleare_cls(self.app)
+    def add(self, middleare_cls, **options):
+        self.app = middleare_cls(self.app, **options)
 
     def process_request(self, req):
+        """
+        Runs before the handler. Returning a `Response` skips the handler
+        and the inner middleware and sends that response instead.
+        """
+
         pass
 
-    def process_response(self, resp):
+    def process_response(self, req, resp):
         pass
 
     def handle_request(self, request):
-        self.process_request(request)
-        response = self.app.handle_request(request)
+        response = self.process_request(request)
+        if not isinstance(response, Response):
+            response = self.app.handle_request(request)
         self.process_response(request, response)
 
         return response
+
+    async def handle_request_async(self, request):
+        if overrides(self, "handle_request"):
+            # only the sync method is overridden: run it, and the layers
+            # inside it, in the ASGI thread pool rather than skip it
+            return await request.app.asgi.run_sync(self.handle_request, request)
+
+        response = self.process_request(request)
+        if not isinstance(response, Response):
+            response = await self.app.handle_request_async(request)
+        self.process_response(request, response)
+
+        return response
+
+
+def overrides(layer, name):
+    return getattr(type(layer), name) is not getattr(Middleware, name)
+
+
+def timed(metrics, layer, hook_name, hook):
+    labels = (("middleware", type(layer).__name__), ("hook", hook_name))
+
+    def call(*args):
+        start = perf_counter()
+        try:
+            return hook(*args)
+        finally:
+            metrics.observe(
+                "octopus_middleware_seconds", perf_counter() - start, labels
+            )
+
+    return call
+
+
+class Pipeline:
+    """
+    # Flat Run of Middleware Hooks
+
+    Calls the `process_request` hooks of `layers` (outermost first), then
+    `app`, then the `process_response` hooks innermost first. Only hooks a
+    class overrides are called. When a `process_request` hook returns a
+    `Response`, the rest is skipped and only the `process_response` hooks
+    of that layer and the ones outside it run.
+    """
+
+    def __init__(self, layers, app, metrics=None):
+        self.app = app
+        self.request_hooks = []
+        self.response_hooks = []
+        # hook -> position of its layer, to find where a short-circuit stopped
+        self.positions = {}
+
+        for position, layer in enumerate(layers):
+            if overrides(layer, "process_request"):
+                hook = layer.process_request
+                if metrics is not None:
+                    hook = timed(metrics, layer, "process_request", hook)
+                self.request_hooks.append(hook)
+                self.positions[hook] = position
+
+            if overrides(layer, "process_response"):
+                hook = layer.process_response
+                if metrics is not None:
+                    hook = timed(metrics, layer, "process_response", hook)
+                self.response_hooks.insert(0, hook)
+                self.positions[hook] = position
+
+    def process_request(self, request):
+        for process_request in self.request_hooks:
+            response = process_request(request)
+            if response is not None and isinstance(response, Response):
+                return self.positions[process_request], response
+        return None, None
+
+    def process_response(self, request, response, stop):
+        if stop is None:
+            for process_response in self.response_hooks:
+                process_response(request, response)
+            return
+
+        for process_response in self.response_hooks:
+            if self.positions[process_response] <= stop:
+                process_response(request, response)
+
+    def handle_request(self, request):
+        stop, response = self.process_request(request)
+        if response is None:
+            response = self.app.handle_request(request)
+        self.process_response(request, response, stop)
+
+        return response
+
+    async def handle_request_async(self, request):
+        stop, response = self.process_request(request)
+        if response is None:
+            response = await self.app.handle_request_async(request)
+        self.process_response(request, response, stop)
+
+        return response
+
+
+class MiddlewareStack:
+    """
+    # Compiled Middleware Chain
+
+    Keeps the middleware added with `app.add_middleware` (the last added
+    runs first) and compiles it into flat `Pipeline`s, so a request makes
+    one call per overridden hook rather than recursing through every layer.
+    Middleware overriding `handle_request` itself (e.g. `CacheMiddleware`)
+    wraps the pipeline of the layers inside it. With metrics enabled, every
+    hook is timed into `octopus_middleware_seconds`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # outermost first
+        self.layers = []
+        self.pipeline = app
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        response = self.pipeline.handle_request(request)
+        return response(environ, start_response)
+
+    def add(self, middleare_cls, **options):
+        inner = self.layers[0] if self.layers else self.app
+        self.layers.insert(0, middleare_cls(inner, **options))
+        self.compile()
+
+    def compile(self):
+        metrics = getattr(self.app, "metrics", None)
+        inner = self.app
+        run = []
+
+        for layer in reversed(self.layers):
+            if overrides(layer, "handle_request") or overrides(
+                layer, "handle_request_async"
+            ):
+                layer.app = self.flatten(run, inner, metrics)
+                inner = layer
+                run = []
+            else:
+                run.insert(0, layer)
+
+        self.pipeline = self.flatten(run, inner, metrics)
+
+    def flatten(self, layers, app, metrics):
+        pipeline = Pipeline(layers, app, metrics)
+        if not pipeline.request_hooks and not pipeline.response_hooks:
+            return app
+        return pipeline
+
+    def handle_request(self, request):
+        return self.pipeline.handle_request(request)
+
+    async def handle_request_async(self, request):
+        return await self.pipeline.handle_request_async(request)
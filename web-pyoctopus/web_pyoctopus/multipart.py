@@ -0,0 +1,173 @@
+# multipart.py
+import os
+import shutil
+import tempfile
+from email.parser import BytesHeaderParser
+
+from .request import BadRequest, FormData
+
+
+# uploads larger than this are moved from memory to a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+# limits for the parts of a form that are kept in memory
+MAX_HEADER_SIZE = 16 * 1024
+MAX_FIELD_SIZE = 1024 * 1024
+MAX_FORM_SIZE = 8 * 1024 * 1024
+MAX_FIELDS = 1000
+
+
+class MultipartError(BadRequest, ValueError):
+    pass
+
+
+class UploadFile:
+    """
+    # File Part of a Multipart Form
+
+    `file` is a `SpooledTemporaryFile`, in memory while the upload is small
+    and on disk once it passes the spool size, positioned at the start.
+    """
+
+    def __init__(self, filename, content_type, headers, spool_size=SPOOL_SIZE):
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def save(self, destination):
+        self.file.seek(0)
+        with open(destination, "wb") as f:
+            shutil.copyfileobj(self.file, f)
+        self.file.seek(0)
+
+    def close(self):
+        self.file.close()
+
+    def __repr__(self):
+        return f"<UploadFile {self.filename!r} ({self.size} bytes)>"
+
+
+def boundary_from(content_type):
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary":
+            return value.strip('"').encode("latin-1")
+    raise MultipartError("multipart body without a boundary")
+
+
+def parse_multipart(chunks, boundary, spool_size=SPOOL_SIZE):
+    """
+    Parses a multipart/form-data body read as `chunks`, holding at most one
+    chunk plus a boundary in memory besides the fields. Returns `(form,
+    files)` as `FormData`: field values as strings and file parts as
+    `UploadFile`s, with every part of a repeated name kept.
+    """
+
+    form, files = FormData(), FormData()
+    parts = form_size = 0
+    # the first delimiter may lack the leading CRLF, so add one
+    delimiter = b"\r\n--" + boundary
+    buffer = b"\r\n"
+    chunks = iter(chunks)
+
+    def fill():
+        nonlocal buffer
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise MultipartError("multipart body ended before the final boundary")
+        buffer += chunk
+
+    # skip the preamble
+    while True:
+        index = buffer.find(delimiter)
+        if index >= 0:
+            buffer = buffer[index + len(delimiter) :]
+            break
+        buffer = buffer[-len(delimiter) :]
+        fill()
+
+    while True:
+        while len(buffer) < 2:
+            fill()
+        if buffer.startswith(b"--"):
+            return form, files
+
+        # part headers
+        while True:
+            end = buffer.find(b"\r\n\r\n")
+            if end >= 0:
+                break
+            if len(buffer) > MAX_HEADER_SIZE:
+                raise MultipartError("multipart part headers are too large")
+            fill()
+        headers = BytesHeaderParser().parsebytes(buffer[:end].lstrip(b"\r\n"))
+        buffer = buffer[end + 4 :]
+
+        name = headers.get_param("name", header="content-disposition")
+        filename = headers.get_filename()
+        if name is None:
+            raise MultipartError("multipart part without a name")
+        parts += 1
+        if parts > MAX_FIELDS:
+            raise MultipartError(f"multipart body has more than {MAX_FIELDS} parts")
+
+        if filename is None:
+            part, field = None, []
+        else:
+            part = UploadFile(
+                filename,
+                headers.get_content_type(),
+                dict(headers.items()),
+                spool_size=spool_size,
+            )
+        written = 0
+
+        # part body, up to the next delimiter
+        while True:
+            index = buffer.find(delimiter)
+            if index >= 0:
+                data, buffer = buffer[:index], buffer[index + len(delimiter) :]
+            else:
+                # keep enough to recognise a delimiter split across chunks
+                keep = len(delimiter) - 1
+                data, buffer = buffer[:-keep], buffer[-keep:]
+
+            if data:
+                if part is not None:
+                    part.write(data)
+                else:
+                    written += len(data)
+                    form_size += len(data)
+                    if written > MAX_FIELD_SIZE:
+                        raise MultipartError(f"form field {name!r} is too large")
+                    if form_size > MAX_FORM_SIZE:
+                        raise MultipartError("form fields are too large")
+                    field.append(data)
+
+            if index >= 0:
+                break
+            fill()
+
+        if part is not None:
+            part.seek(0)
+            files.add(name, part)
+        else:
+            charset = headers.get_content_charset() or "utf-8"
+            try:
+                form.add(name, b"".join(field).decode(charset))
+            except (UnicodeDecodeError, LookupError):
+                raise MultipartError(
+                    f"form field {name!r} is not valid {charset}"
+                ) from None
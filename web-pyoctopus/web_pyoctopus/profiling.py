@@ -0,0 +1,139 @@
+# profiling.py
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from .metrics import UNMATCHED_ROUTE
+from .request import Request
+
+
+def route_label(environ):
+    # reuses the match kept in the environ when the request was served
+    handler_data = Request(environ).route[0]
+    if handler_data is None:
+        return UNMATCHED_ROUTE
+    return handler_data["path"]
+
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """
+    # Sampling Profiler and Slow-Request Capture
+
+    Runs one in `1 / sample_rate` requests under cProfile and writes its
+    stats as a `.prof` file (readable with `pstats` or snakeviz). With a
+    `slow_threshold` in seconds, a background thread also samples the stack
+    of every request that runs longer than that, every `interval` seconds,
+    and writes the samples as flamegraph-ready collapsed stacks
+    (`.collapsed`). Files go to `directory/<route>/`.
+    """
+
+    def __init__(
+        self, app, directory, sample_rate=0.001, slow_threshold=None, interval=0.005
+    ):
+        self.app = app
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+
+        # thread id -> [start time, collapsed stack counts]
+        self.active = {}
+        self.lock = threading.Lock()
+        self.sampler_pid = None
+
+    def profile(self, serve, environ, start_response):
+        if self.slow_threshold is not None:
+            self.ensure_sampler()
+
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.run_sampled(serve, environ, start_response)
+
+        if self.slow_threshold is None:
+            return serve(environ, start_response)
+
+        thread_id = threading.get_ident()
+        start = time.perf_counter()
+        stacks = Counter()
+        with self.lock:
+            self.active[thread_id] = [start, stacks]
+
+        try:
+            return serve(environ, start_response)
+        finally:
+            with self.lock:
+                del self.active[thread_id]
+            if stacks and time.perf_counter() - start >= self.slow_threshold:
+                self.write_stacks(route_label(environ), stacks)
+
+    def run_sampled(self, serve, environ, start_response):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return serve(environ, start_response)
+        finally:
+            profiler.disable()
+            route = route_label(environ)
+            profiler.dump_stats(self.output_path(route, "prof"))
+
+    def ensure_sampler(self):
+        # threads don't survive a fork, so each worker starts its own
+        if self.sampler_pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.sampler_pid == os.getpid():
+                return
+            self.sampler_pid = os.getpid()
+
+        sampler = threading.Thread(
+            target=self.sample_forever, name="octopus-profiler", daemon=True
+        )
+        sampler.start()
+
+    def sample_forever(self):
+        own_thread = threading.get_ident()
+
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+
+            with self.lock:
+                slow = [
+                    (thread_id, stacks)
+                    for thread_id, (start, stacks) in self.active.items()
+                    if now - start >= self.slow_threshold and thread_id != own_thread
+                ]
+                if not slow:
+                    continue
+
+                frames = sys._current_frames()
+                for thread_id, stacks in slow:
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+
+    def write_stacks(self, route, stacks):
+        with open(self.output_path(route, "collapsed"), "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def output_path(self, route, extension):
+        route_dir = re.sub(r"[^A-Za-z0-9_.-]+", "_", route).strip("_") or "root"
+        directory = os.path.join(self.directory, route_dir)
+        os.makedirs(directory, exist_ok=True)
+
+        return os.path.join(directory, f"{time.time_ns()}-{os.getpid()}.{extension}")
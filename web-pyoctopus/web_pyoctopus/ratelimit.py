@@ -0,0 +1,245 @@
+# ratelimit.py
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from .middleware import Middleware
+from .response import Response
+
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate(rate):
+    """
+    `"100/minute"`, `"5/second"` or `(requests, period seconds)`, optionally
+    with a third item for the burst size, into `(requests, period, burst)`.
+    """
+
+    if isinstance(rate, str):
+        requests, _, period = rate.partition("/")
+        period = period.strip().rstrip("s")
+        if period not in PERIODS:
+            raise ValueError(f"Unknown rate limit period in {rate!r}")
+        rate = (int(requests), PERIODS[period])
+
+    requests, period = rate[0], rate[1]
+    burst = rate[2] if len(rate) > 2 else requests
+    return requests, float(period), burst
+
+
+def gcra(tat, now, interval, tolerance):
+    """
+    Generic cell rate algorithm: `tat` is the theoretical arrival time
+    stored for the key, `interval` the seconds between requests at the
+    sustained rate and `tolerance` how far ahead of it a burst may run.
+    Returns `(new_tat, wait)`; `new_tat` is None when the request is
+    refused, and `wait` is then the seconds until it would be allowed.
+    """
+
+    tat = max(tat, now)
+    ahead = tat - now
+    if ahead > tolerance:
+        return None, ahead - tolerance
+    return tat + interval, 0.0
+
+
+class RateLimitBackend:
+    """
+    # Interface for Rate Limit Stores
+
+    `acquire` runs `gcra` for `key` atomically and returns the wait in
+    seconds, 0.0 when the request is allowed.
+    """
+
+    def acquire(self, key, interval, tolerance):
+        raise NotImplementedError
+
+
+class MemoryRateLimit(RateLimitBackend):
+    """
+    # Per-Process Rate Limit Store
+
+    An LRU of theoretical arrival times holding at most `max_keys` keys;
+    past that the least recently seen key is evicted, in O(1).
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self.tats = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, key, interval, tolerance):
+        now = time.monotonic()
+        tats = self.tats
+
+        with self.lock:
+            new_tat, wait = gcra(tats.get(key, now), now, interval, tolerance)
+            if new_tat is not None:
+                tats[key] = new_tat
+                tats.move_to_end(key)
+                if len(tats) > self.max_keys:
+                    tats.popitem(last=False)
+
+        return wait
+
+
+class SharedMemoryRateLimit(RateLimitBackend):
+    """
+    # Rate Limit Store Shared Between Processes
+
+    A fixed table of `slots` (key hash, theoretical arrival time) pairs in a
+    memory-mapped file, so every Gunicorn worker on the host enforces the
+    same limits without an external store. Keys are hashed to a slot and
+    probe a few neighbours; when all are taken by live keys the one closest
+    to expiring is reused. Updates hold an `flock` on the file (POSIX).
+    """
+
+    SLOT = struct.Struct("<Qd")
+    PROBES = 8
+
+    def __init__(self, path, slots=65536):
+        import fcntl
+
+        self.flock = fcntl.flock
+        self.lock_ex, self.lock_un = fcntl.LOCK_EX, fcntl.LOCK_UN
+
+        self.slots = slots
+        size = slots * self.SLOT.size
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.table = mmap.mmap(self.fd, size)
+        # flock is per process, so threads take this lock first
+        self.lock = threading.Lock()
+
+    def hash(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        # 0 marks an empty slot
+        return int.from_bytes(digest, "little") or 1
+
+    def acquire(self, key, interval, tolerance):
+        key_hash = self.hash(key)
+        now = time.time()
+
+        with self.lock:
+            self.flock(self.fd, self.lock_ex)
+            try:
+                offset, tat = self.find(key_hash, now)
+                new_tat, wait = gcra(tat, now, interval, tolerance)
+                if new_tat is not None:
+                    self.SLOT.pack_into(self.table, offset, key_hash, new_tat)
+            finally:
+                self.flock(self.fd, self.lock_un)
+
+        return wait
+
+    def find(self, key_hash, now):
+        """
+        Offset of the key's slot and its stored time (`now` for a new key).
+        """
+
+        reuse = None
+        reuse_tat = math.inf
+
+        for probe in range(self.PROBES):
+            offset = ((key_hash + probe) % self.slots) * self.SLOT.size
+            slot_hash, tat = self.SLOT.unpack_from(self.table, offset)
+            if slot_hash == key_hash:
+                return offset, tat
+            if slot_hash == 0 or tat <= now:
+                tat = -math.inf
+            if tat < reuse_tat:
+                reuse, reuse_tat = offset, tat
+
+        return reuse, now
+
+    def close(self):
+        self.table.close()
+        os.close(self.fd)
+
+
+class RateLimitMiddleware(Middleware):
+    """
+    # Rate Limiting
+
+    Limits requests per key with GCRA (a token bucket stored as a single
+    timestamp per key, so every check is O(1)), answering with 429 and
+    `Retry-After` once a key is over its rate. `rate` applies to every
+    route; routes declare their own with the `rate_limit` option, or opt
+    out with `rate_limit=None`. `key` is `"ip"`, `"header:<Name>"`,
+    `"route"` (one limit per route, shared by all clients) or a callable
+    taking the request. Limits of different routes are counted apart.
+
+        app.add_middleware(
+            RateLimitMiddleware, backend=SharedMemoryRateLimit("/tmp/octopus.rl")
+        )
+
+        @app.route("/login", rate_limit="5/minute")
+        def login(req, resp):
+            ...
+    """
+
+    def __init__(self, app, rate=None, key="ip", backend=None):
+        super().__init__(app)
+        self.rate = parse_rate(rate) if rate is not None else None
+        self.key = key
+        self.backend = backend if backend is not None else MemoryRateLimit()
+        self.parsed_rates = {}
+
+    def route_rate(self, req):
+        options = req.route_options
+        if "rate_limit" not in options:
+            return self.rate
+
+        rate = options["rate_limit"]
+        if rate is None:
+            return None
+        parsed = self.parsed_rates.get(rate)
+        if parsed is None:
+            parsed = self.parsed_rates[rate] = parse_rate(rate)
+        return parsed
+
+    def client_key(self, req):
+        key = req.route_options.get("rate_limit_key", self.key)
+
+        if callable(key):
+            return str(key(req))
+        if key == "ip":
+            return req.remote_addr or ""
+        if key == "route":
+            return ""
+        if key.startswith("header:"):
+            return req.headers.get(key[len("header:") :], "")
+        raise ValueError(f"Unknown rate limit key {key!r}")
+
+    def process_request(self, req):
+        rate = self.route_rate(req)
+        if rate is None:
+            return None
+
+        requests, period, burst = rate
+        interval = period / requests
+        handler_data = req.route[0]
+        route = handler_data["path"] if handler_data is not None else ""
+        key = f"{route}\n{self.client_key(req)}"
+
+        wait = self.backend.acquire(key, interval, interval * (burst - 1))
+        if not wait:
+            return None
+
+        metrics = getattr(req.app, "metrics", None)
+        if metrics is not None:
+            metrics.inc("octopus_rate_limited_total", (("route", route),))
+
+        response = Response()
+        response.status_code = 429
+        response.text = "Too Many Requests!"
+        response.headers["Retry-After"] = str(math.ceil(wait))
+        return response
@@ -0,0 +1,393 @@
+# request.py
+import io
+import json
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+from wsgiref.util import request_uri
+
+
+# environ key under which OctopusAPI registers itself for the request
+APP_ENVIRON_KEY = "web_pyoctopus.app"
+
+# environ key holding the route match, shared by every Request on the environ
+ROUTE_ENVIRON_KEY = "web_pyoctopus.route"
+
+# read size of `Request.stream()`
+CHUNK_SIZE = 64 * 1024
+
+
+class PayloadTooLarge(Exception):
+    """
+    The request body is larger than the route's `max_body_size`; answered
+    with 413.
+    """
+
+
+class BadRequest(Exception):
+    """
+    The request body can't be parsed, e.g. a malformed multipart form;
+    answered with 400.
+    """
+
+
+class Headers(dict):
+    """
+    # Case-Insensitive View of the Request Headers
+    """
+
+    def __getitem__(self, name):
+        return super().__getitem__(name.lower())
+
+    def __contains__(self, name):
+        return super().__contains__(name.lower())
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+
+class FormData(dict):
+    """
+    # Form Fields or Files by Name
+
+    Indexing gives the last value sent for a name, like a plain dict;
+    `getlist` gives all of them, for repeated fields and multi-file inputs.
+    """
+
+    def __init__(self, pairs=()):
+        super().__init__()
+        self.lists = {}
+        for name, value in pairs:
+            self.add(name, value)
+
+    def add(self, name, value):
+        self[name] = value
+        self.lists.setdefault(name, []).append(value)
+
+    def getlist(self, name):
+        return list(self.lists.get(name, ()))
+
+
+def headers_from_environ(environ):
+    headers = Headers()
+
+    for key, value in environ.items():
+        if key.startswith("HTTP_"):
+            headers[key[5:].replace("_", "-").lower()] = value
+        elif key in ("CONTENT_TYPE", "CONTENT_LENGTH") and value:
+            headers[key.replace("_", "-").lower()] = value
+
+    return headers
+
+
+class Request:
+    """
+    # Request Passed to Handlers and Middleware
+
+    Wraps the WSGI environ and parses the path, query string, headers,
+    cookies and body only when they are first accessed, caching the result.
+    `request.webob` builds a full `webob.Request` for anything else, and
+    unknown attributes are looked up there too. Ad hoc attributes are stored
+    where WebOb keeps them, so both views share them.
+    """
+
+    __slots__ = (
+        "environ",
+        "_path",
+        "_query",
+        "_headers",
+        "_cookies",
+        "_body",
+        "_route",
+        "_webob",
+        "_form",
+        "_streamed",
+    )
+
+    def __init__(self, environ):
+        object.__setattr__(self, "environ", environ)
+
+    def __setattr__(self, name, value):
+        if name in SLOTS:
+            object.__setattr__(self, name, value)
+        else:
+            self.environ.setdefault("webob.adhoc_attrs", {})[name] = value
+
+    def __getattr__(self, name):
+        # only reached for names that aren't slots, properties or methods
+        if name.startswith("_") or name == "environ":
+            raise AttributeError(name)
+
+        adhoc_attrs = self.environ.get("webob.adhoc_attrs")
+        if adhoc_attrs is not None and name in adhoc_attrs:
+            return adhoc_attrs[name]
+
+        return getattr(self.webob, name)
+
+    @property
+    def webob(self):
+        try:
+            return self._webob
+        except AttributeError:
+            from webob import Request as WebObRequest
+
+            self._webob = WebObRequest(self.environ)
+            return self._webob
+
+    @property
+    def app(self):
+        return self.environ.get(APP_ENVIRON_KEY)
+
+    @property
+    def route(self):
+        """
+        `(handler_data, kwargs)` of the matching route, or `(None, None)`.
+        Routing happens once per request, whoever asks first.
+        """
+
+        try:
+            return self._route
+        except AttributeError:
+            pass
+
+        route = self.environ.get(ROUTE_ENVIRON_KEY)
+        if route is None:
+            app = self.app
+            if app is None:
+                return None, None
+            route = app.find_handler(request_path=self.path)
+            self.environ[ROUTE_ENVIRON_KEY] = route
+        self._route = route
+        return route
+
+    @property
+    def route_options(self):
+        handler_data = self.route[0]
+        if handler_data is None:
+            return {}
+        return handler_data["options"]
+
+    @property
+    def method(self):
+        return self.environ["REQUEST_METHOD"]
+
+    @property
+    def scheme(self):
+        return self.environ.get("wsgi.url_scheme", "http")
+
+    @property
+    def script_name(self):
+        return self.environ.get("SCRIPT_NAME", "").encode("latin-1").decode("utf-8")
+
+    @property
+    def path_info(self):
+        return self.environ.get("PATH_INFO", "").encode("latin-1").decode("utf-8")
+
+    @property
+    def path(self):
+        try:
+            return self._path
+        except AttributeError:
+            self._path = self.script_name + self.path_info
+            return self._path
+
+    @property
+    def query_string(self):
+        return self.environ.get("QUERY_STRING", "")
+
+    @property
+    def query(self):
+        try:
+            return self._query
+        except AttributeError:
+            self._query = dict(parse_qsl(self.query_string, keep_blank_values=True))
+            return self._query
+
+    @property
+    def url(self):
+        return request_uri(self.environ)
+
+    @property
+    def host(self):
+        host = self.environ.get("HTTP_HOST")
+        if host is None:
+            host = f"{self.environ['SERVER_NAME']}:{self.environ['SERVER_PORT']}"
+        return host
+
+    @property
+    def remote_addr(self):
+        return self.environ.get("REMOTE_ADDR")
+
+    @property
+    def headers(self):
+        try:
+            return self._headers
+        except AttributeError:
+            self._headers = headers_from_environ(self.environ)
+            return self._headers
+
+    @property
+    def cookies(self):
+        try:
+            return self._cookies
+        except AttributeError:
+            cookie = SimpleCookie()
+            cookie.load(self.environ.get("HTTP_COOKIE", ""))
+            self._cookies = {name: morsel.value for name, morsel in cookie.items()}
+            return self._cookies
+
+    @property
+    def content_type(self):
+        return self.environ.get("CONTENT_TYPE", "").split(";", 1)[0].strip()
+
+    @property
+    def content_length(self):
+        content_length = self.environ.get("CONTENT_LENGTH")
+        if not content_length:
+            return None
+        try:
+            return int(content_length)
+        except ValueError:
+            raise BadRequest(f"invalid Content-Length {content_length!r}") from None
+
+    @property
+    def max_body_size(self):
+        """
+        The route's `max_body_size` option, or the app's default.
+        """
+
+        max_body_size = self.route_options.get("max_body_size")
+        if max_body_size is None:
+            max_body_size = getattr(self.app, "max_body_size", None)
+        return max_body_size
+
+    def check_body_size(self):
+        # declared sizes are refused before anything is read
+        max_body_size = self.max_body_size
+        if max_body_size is not None and (self.content_length or 0) > max_body_size:
+            raise PayloadTooLarge(max_body_size)
+
+    def stream(self, chunk_size=CHUNK_SIZE):
+        """
+        Yields the body in chunks of at most `chunk_size` bytes without
+        keeping it, so large uploads can be written out as they arrive.
+        The body can be streamed once, unless `body` has been read already.
+        """
+
+        try:
+            body = self._body
+        except AttributeError:
+            pass
+        else:
+            for offset in range(0, len(body), chunk_size):
+                yield body[offset : offset + chunk_size]
+            return
+
+        try:
+            self._streamed
+        except AttributeError:
+            self._streamed = True
+        else:
+            raise RuntimeError("the request body has been streamed already")
+
+        self.check_body_size()
+        max_body_size = self.max_body_size
+        wsgi_input = self.environ.get("wsgi.input")
+        remaining = self.content_length
+        if wsgi_input is None or (
+            remaining is None and not self.environ.get("wsgi.input_terminated")
+        ):
+            return
+
+        received = 0
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = wsgi_input.read(size)
+            if not chunk:
+                break
+            received += len(chunk)
+            if max_body_size is not None and received > max_body_size:
+                raise PayloadTooLarge(max_body_size)
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+    async def stream_async(self, chunk_size=CHUNK_SIZE):
+        """
+        `stream()` for `async def` handlers. Under ASGI the body has been
+        spooled by the server side already, so reads don't wait on the client.
+        """
+
+        for chunk in self.stream(chunk_size):
+            yield chunk
+
+    @property
+    def body(self):
+        try:
+            return self._body
+        except AttributeError:
+            pass
+
+        body = b"".join(self.stream())
+
+        # keep the input readable for WebOb and WSGI code further down
+        self.environ["wsgi.input"] = io.BytesIO(body)
+        self._body = body
+        return body
+
+    def parse_form(self, spool_size=None):
+        """
+        Parses an urlencoded or multipart form into `(form, files)`, once,
+        as `FormData`: `form.getlist(name)` has every value of a repeated field.
+        Multipart bodies are streamed: file parts are spooled to temporary
+        files past `spool_size` bytes (the route's `spool_size` option, or
+        1 MiB), so memory stays bounded whatever the upload size.
+        """
+
+        try:
+            return self._form
+        except AttributeError:
+            pass
+
+        if self.content_type == "multipart/form-data":
+            from .multipart import SPOOL_SIZE, boundary_from, parse_multipart
+
+            if spool_size is None:
+                spool_size = self.route_options.get("spool_size", SPOOL_SIZE)
+            boundary = boundary_from(self.environ.get("CONTENT_TYPE", ""))
+            self._form = parse_multipart(self.stream(), boundary, spool_size)
+        elif self.content_type == "application/x-www-form-urlencoded":
+            from .multipart import MAX_FIELDS
+
+            try:
+                pairs = parse_qsl(
+                    self.text, keep_blank_values=True, max_num_fields=MAX_FIELDS
+                )
+            except ValueError:
+                raise BadRequest(f"form has more than {MAX_FIELDS} fields") from None
+            self._form = (FormData(pairs), FormData())
+        else:
+            self._form = (FormData(), FormData())
+
+        return self._form
+
+    @property
+    def form(self):
+        return self.parse_form()[0]
+
+    @property
+    def files(self):
+        return self.parse_form()[1]
+
+    @property
+    def text(self):
+        try:
+            return self.body.decode("UTF-8")
+        except UnicodeDecodeError:
+            raise BadRequest("request body is not valid UTF-8") from None
+
+    @property
+    def json(self):
+        return json.loads(self.body)
+
+
+SLOTS = frozenset(Request.__slots__)
@@ -1,28 +1,241 @@
-import json
-from webob import Response as WebObResponse
+import os
+from http import HTTPStatus
+
+from .serialization import make_json_dumps
+
+
+# read size used when streaming file objects
+BLOCK_SIZE = 64 * 1024
+
+
+def encode_chunk(chunk):
+    if isinstance(chunk, str):
+        return chunk.encode("UTF-8")
+    return chunk
+
+
+def read_blocks(file, block_size=BLOCK_SIZE):
+    while True:
+        block = file.read(block_size)
+        if not block:
+            break
+        yield block
+
+
+class StreamBody:
+    """
+    # WSGI Iterable Over a Streamed Body
+
+    Yields chunks from a generator, any iterable, an async iterable or a file
+    object as they are produced, encoding `str` chunks as UTF-8 on the way.
+    """
+
+    def __init__(self, stream, block_size=BLOCK_SIZE):
+        self.stream = stream
+        self.is_async = hasattr(stream, "__aiter__")
+
+        if hasattr(stream, "read"):
+            self.chunks = read_blocks(stream, block_size)
+        else:
+            self.chunks = stream
+
+    def __iter__(self):
+        if self.is_async:
+            yield from self.iter_async_blocking()
+            return
+
+        for chunk in self.chunks:
+            if chunk:
+                yield encode_chunk(chunk)
+
+    async def __aiter__(self):
+        async for chunk in self.chunks:
+            if chunk:
+                yield encode_chunk(chunk)
+
+    def iter_async_blocking(self):
+        # drive an async source from a WSGI server on a private event loop
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        iterator = self.chunks.__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = loop.run_until_complete(iterator.__anext__())
+                except StopAsyncIteration:
+                    break
+                if chunk:
+                    yield encode_chunk(chunk)
+        finally:
+            if hasattr(iterator, "aclose"):
+                loop.run_until_complete(iterator.aclose())
+            loop.close()
+
+    def close(self):
+        close = getattr(self.stream, "close", None)
+        if close is not None and not self.is_async:
+            close()
+
+
+# precomputed status lines for every code the stdlib knows about
+STATUS_LINES = {
+    status.value: f"{status.value} {status.phrase}" for status in HTTPStatus
+}
+
+# statuses that must not carry a body
+BODILESS_STATUSES = {100, 101, 102, 103, 204, 304}
+
+DEFAULT_CONTENT_TYPE = "text/html"
+
+CHARSET_CONTENT_TYPES = ("application/javascript", "application/xml")
+
+# used by responses created outside an OctopusAPI
+json_dumps = make_json_dumps("stdlib")
+
+
+def status_line(status_code):
+    line = STATUS_LINES.get(status_code)
+    if line is None:
+        line = f"{status_code} Unknown"
+    return line
+
+
+def content_type_header(content_type):
+    if content_type is None:
+        content_type = DEFAULT_CONTENT_TYPE
+
+    if "charset" not in content_type and (
+        content_type.startswith("text/")
+        or content_type.startswith(CHARSET_CONTENT_TYPES)
+        or content_type.endswith("+xml")
+    ):
+        content_type = f"{content_type}; charset=UTF-8"
+
+    return content_type
 
 
 class Response:
-    def __init__(self):
+    def __init__(self, json_dumps=json_dumps):
+        self.json_dumps = json_dumps
         self.json = None
         self.html = None
         self.text = None
         self.content_type = None
         self.body = b""
+        self.stream = None
         self.status_code = 200
+        self.headers = {}
+        # a webob.Response to serve as-is, for handlers that need WebOb's API
+        self.webob = None
+        # (fn, args, kwargs) to run once the body is sent, see background()
+        self.tasks = None
+
+    def background(self, fn, *args, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` after the response has been sent, on the
+        app's background task pool (or event loop, for `async def` tasks).
+        """
+
+        if self.tasks is None:
+            self.tasks = []
+        self.tasks.append((fn, args, kwargs))
 
     def __call__(self, environ, start_response):
+        if self.tasks:
+            return self.call_with_tasks(environ, start_response)
+
+        if self.webob is not None:
+            return self.webob(environ, start_response)
+
+        if self.stream is not None:
+            return self.stream_response(environ, start_response)
+
+        self.set_body_and_content_type()
+
+        body = self.body
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+
+        if self.status_code in BODILESS_STATUSES:
+            headers = []
+            body = b""
+        else:
+            headers = [
+                ("Content-Type", content_type_header(self.content_type)),
+                ("Content-Length", str(len(body))),
+            ]
+
+        if self.headers:
+            headers.extend(self.headers.items())
+
+        start_response(status_line(self.status_code), headers)
+
+        if environ["REQUEST_METHOD"] == "HEAD":
+            return []
+        return [body]
+
+    def call_with_tasks(self, environ, start_response):
+        from .background import TasksBody
+
+        tasks, self.tasks = self.tasks, None
+        return TasksBody(self(environ, start_response), tasks, environ)
+
+    def stream_response(self, environ, start_response):
+        stream = self.stream
+        headers = [("Content-Type", content_type_header(self.content_type))]
+
+        if hasattr(stream, "read"):
+            content_length = self.remaining_file_size(stream)
+            if content_length is not None:
+                headers.append(("Content-Length", str(content_length)))
+
+            file_wrapper = environ.get("wsgi.file_wrapper")
+            if file_wrapper is not None:
+                # lets the server hand the file to sendfile()
+                app_iter = file_wrapper(stream, BLOCK_SIZE)
+            else:
+                app_iter = StreamBody(stream)
+        else:
+            app_iter = StreamBody(stream)
+
+        if self.headers:
+            headers.extend(self.headers.items())
+
+        start_response(status_line(self.status_code), headers)
+
+        if environ["REQUEST_METHOD"] == "HEAD":
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+            return []
+        return app_iter
+
+    def to_webob(self):
+        from webob import Response as WebObResponse
+
         self.set_body_and_content_type()
 
         response = WebObResponse(
             body=self.body, content_type=self.content_type, status=self.status_code
         )
+        for name, value in self.headers.items():
+            response.headers[name] = value
+
+        return response
 
-        return response(environ, start_response)
+    def remaining_file_size(self, file):
+        try:
+            return os.fstat(file.fileno()).st_size - file.tell()
+        except (AttributeError, OSError, ValueError):
+            return None
 
     def set_body_and_content_type(self):
         if self.json is not None:
-            self.body = json.dumps(self.json).encode("UTF-8")
+            if isinstance(self.json, bytes):
+                # already serialised, e.g. a cached document
+                self.body = self.json
+            else:
+                self.body = self.json_dumps(self.json)
             self.content_type = "application/json"
 
         if self.html is not None:
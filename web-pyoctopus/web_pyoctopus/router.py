@@ -0,0 +1,159 @@
+# router.py
+import re
+from collections import OrderedDict
+
+from parse import compile as compile_pattern
+
+
+# a segment that is nothing but a bare `{name}` placeholder
+PLAIN_PARAM = re.compile(r"^\{([A-Za-z_]\w*)\}$")
+
+
+class Node:
+    __slots__ = ("static", "patterns", "params", "handler_data")
+
+    def __init__(self):
+        self.static = {}
+        self.patterns = {}
+        self.params = {}
+        self.handler_data = None
+
+
+def split_path(path):
+    return path.split("/")[1:]
+
+
+class Router:
+    """
+    # Segment Trie of Route Templates
+
+    Templates are compiled once, when they are added. Static segments are
+    looked up in a dict, typed fields (`{id:d}`) are validated while
+    descending and bare fields (`{name}`) capture a whole segment, so a
+    lookup costs O(path depth) instead of O(number of routes). Matching is
+    case-sensitive, static segments and typed fields alike: `/HOME` does
+    not match a `/home` route.
+
+    Placeholder-free templates skip the trie entirely through an exact-match
+    dict, and paths that matched nothing are remembered in a bounded LRU so
+    repeated 404s (scanners, favicon probes) cost a single dict lookup.
+    """
+
+    def __init__(self, miss_cache_size=1024):
+        self.root = Node()
+        self.static_routes = {}
+        self.miss_cache = OrderedDict()
+        self.miss_cache_size = miss_cache_size
+        self.stats = {
+            "static_hits": 0,
+            "dynamic_hits": 0,
+            "cached_misses": 0,
+            "misses": 0,
+        }
+
+    def add(self, path, handler_data):
+        # a new route may turn a remembered 404 into a hit
+        self.miss_cache.clear()
+
+        if "{" not in path:
+            self.static_routes[path] = handler_data
+            return
+
+        node = self.root
+
+        for segment in split_path(path):
+            if "{" not in segment:
+                node = node.static.setdefault(segment, Node())
+                continue
+
+            plain = PLAIN_PARAM.match(segment)
+            if plain is not None:
+                node = node.params.setdefault(plain.group(1), Node())
+                continue
+
+            if segment not in node.patterns:
+                node.patterns[segment] = (
+                    compile_pattern(segment, case_sensitive=True),
+                    Node(),
+                )
+            node = node.patterns[segment][1]
+
+        node.handler_data = handler_data
+
+    def match(self, request_path):
+        stats = self.stats
+
+        handler_data = self.static_routes.get(request_path)
+        if handler_data is not None:
+            stats["static_hits"] += 1
+            return handler_data, {}
+
+        if request_path in self.miss_cache:
+            stats["cached_misses"] += 1
+            try:
+                self.miss_cache.move_to_end(request_path)
+            except KeyError:
+                pass
+            return None, None
+
+        kwargs = {}
+        handler_data = self._match(self.root, split_path(request_path), 0, kwargs)
+
+        if handler_data is None:
+            stats["misses"] += 1
+            self.remember_miss(request_path)
+            return None, None
+
+        stats["dynamic_hits"] += 1
+        return handler_data, kwargs
+
+    def remember_miss(self, request_path):
+        if self.miss_cache_size <= 0:
+            return
+
+        self.miss_cache[request_path] = True
+        while len(self.miss_cache) > self.miss_cache_size:
+            try:
+                self.miss_cache.popitem(last=False)
+            except KeyError:
+                break
+
+    def hit_rates(self):
+        stats = dict(self.stats)
+        total = sum(stats.values())
+
+        return {key: (value / total if total else 0.0) for key, value in stats.items()}
+
+    def _match(self, node, segments, index, kwargs):
+        if index == len(segments):
+            return node.handler_data
+
+        segment = segments[index]
+
+        # static segments win over typed fields, typed fields over bare ones
+        child = node.static.get(segment)
+        if child is not None:
+            handler_data = self._match(child, segments, index + 1, kwargs)
+            if handler_data is not None:
+                return handler_data
+
+        if not segment:
+            return None
+
+        for pattern, child in node.patterns.values():
+            # only validate while descending, convert once the route matched
+            match = pattern.parse(segment, evaluate_result=False)
+            if match is None:
+                continue
+            handler_data = self._match(child, segments, index + 1, kwargs)
+            if handler_data is not None:
+                kwargs.update(match.evaluate_result().named)
+                return handler_data
+
+        for name, child in node.params.items():
+            handler_data = self._match(child, segments, index + 1, kwargs)
+            if handler_data is not None:
+                kwargs[name] = segment
+                return handler_data
+
+        return None
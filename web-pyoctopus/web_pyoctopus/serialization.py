@@ -0,0 +1,101 @@
+# serialization.py
+import dataclasses
+import datetime
+import decimal
+import json
+import uuid
+
+
+# tried in order when no backend is asked for explicitly
+AUTO_BACKENDS = ("orjson", "ujson", "stdlib")
+
+
+def default_encoder(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+
+    if isinstance(obj, (uuid.UUID, decimal.Decimal)):
+        return str(obj)
+
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def chain_encoders(*encoders):
+    def default(obj):
+        for encoder in encoders[:-1]:
+            try:
+                return encoder(obj)
+            except TypeError:
+                continue
+        return encoders[-1](obj)
+
+    return default
+
+
+def stdlib_dumps(default):
+    encoder = json.JSONEncoder(default=default)
+
+    def dumps(obj):
+        return encoder.encode(obj).encode("UTF-8")
+
+    return dumps
+
+
+def orjson_dumps(default):
+    import orjson
+
+    # stdlib json accepts int, float, bool and None keys, so orjson must too
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=default, option=option)
+
+    return dumps
+
+
+def ujson_dumps(default):
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(
+            obj, default=default, escape_forward_slashes=False
+        ).encode("UTF-8")
+
+    return dumps
+
+
+BACKENDS = {"stdlib": stdlib_dumps, "orjson": orjson_dumps, "ujson": ujson_dumps}
+
+
+def make_json_dumps(backend=None, default=None):
+    """
+    Returns a `dumps(obj) -> bytes` for the given backend name ("stdlib",
+    "orjson" or "ujson"). Without a name the fastest installed one is used.
+    `default` serialises objects the backend doesn't know about; whatever it
+    rejects with TypeError goes to `default_encoder`.
+    """
+
+    if default is None:
+        default = default_encoder
+    else:
+        default = chain_encoders(default, default_encoder)
+
+    if backend is None:
+        for name in AUTO_BACKENDS:
+            try:
+                return BACKENDS[name](default)
+            except ImportError:
+                continue
+
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown JSON backend {backend!r}, expected one of {sorted(BACKENDS)}"
+        )
+
+    return BACKENDS[backend](default)
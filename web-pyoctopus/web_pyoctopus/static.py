@@ -0,0 +1,414 @@
+# static.py
+import gzip
+import hashlib
+import json
+import mimetypes
+import mmap
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+
+from .cache import etag_matches
+from .response import BLOCK_SIZE, content_type_header, read_blocks, status_line
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+# hex digits of the content hash build_manifest() puts in file names
+DIGEST_LENGTH = 12
+
+# file names carrying a content hash, e.g. `app.3f2a9c1b7d4e.css`; exactly
+# DIGEST_LENGTH digits, so dated names like `report.20241018.pdf` aren't
+HASHED_NAME = re.compile(rf"\.[0-9a-f]{{{DIGEST_LENGTH}}}\.[A-Za-z0-9]+$")
+
+DEFAULT_TYPE = "application/octet-stream"
+
+# logical name -> hashed name, written by build_manifest() into static_dir
+MANIFEST_NAME = "manifest.json"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# formats that are compressed already, or gain too little to be worth it
+SKIP_COMPRESS_EXTENSIONS = frozenset(
+    "7z avif br bz2 gif gz heic ico jpeg jpg mp3 mp4 ogg png rar webm webp "
+    "woff woff2 xz zip zst".split()
+)
+
+# preferred first; a client must accept an encoding to be sent it
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+ENCODING_SUFFIXES = tuple(suffix for _, suffix in ENCODINGS)
+
+
+def compress_file(path, min_size=256, min_ratio=0.95):
+    """
+    Writes `path.gz` and, when brotli is installed, `path.br` next to `path`,
+    keeping only variants that save at least `1 - min_ratio` of the size.
+    Returns the paths written.
+    """
+
+    extension = path.rsplit(".", 1)[-1].lower()
+    size = os.path.getsize(path)
+    if extension in SKIP_COMPRESS_EXTENSIONS or size < min_size:
+        return []
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    compressors = [(".gz", lambda data: gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        compressors.insert(0, (".br", brotli.compress))
+
+    written = []
+    for suffix, compress in compressors:
+        compressed = compress(data)
+        if len(compressed) > size * min_ratio:
+            continue
+        temp_path = f"{path}{suffix}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(temp_path, path + suffix)
+        written.append(path + suffix)
+
+    return written
+
+
+def compress_directory(root, **options):
+    """
+    Precompresses every file under `root` that is newer than its compressed
+    variants. Returns the paths written.
+    """
+
+    written = []
+    for path in iter_files(root):
+        if path.endswith(ENCODING_SUFFIXES):
+            continue
+        mtime = os.path.getmtime(path)
+        if all(
+            os.path.exists(path + suffix)
+            and os.path.getmtime(path + suffix) >= mtime
+            for suffix in (".gz",) + ((".br",) if brotli is not None else ())
+        ):
+            continue
+        written.extend(compress_file(path, **options))
+
+    return written
+
+
+def iter_files(root):
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        for filename in filenames:
+            if not filename.startswith("."):
+                yield os.path.join(directory, filename)
+
+
+def file_digest(path, length=DIGEST_LENGTH):
+    digest = hashlib.blake2b(digest_size=length // 2)
+    with open(path, "rb") as f:
+        for block in read_blocks(f):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    base, extension = os.path.splitext(name)
+    return f"{base}.{digest}{extension}"
+
+
+def build_manifest(root):
+    """
+    Copies every file under `root` to a name carrying its content hash
+    (`css/app.css` -> `css/app.3f2a9c1b7d4e.css`) and writes the mapping to
+    `root/manifest.json`. Earlier hashed copies are kept for clients still
+    holding old pages. Returns the manifest.
+    """
+
+    manifest = {}
+
+    for path in sorted(iter_files(root)):
+        name = os.path.relpath(path, root).replace(os.sep, "/")
+        if (
+            name == MANIFEST_NAME
+            or HASHED_NAME.search(name)
+            or path.endswith(ENCODING_SUFFIXES)
+        ):
+            continue
+
+        hashed = hashed_name(name, file_digest(path))
+        hashed_path = os.path.join(root, *hashed.split("/"))
+        if not os.path.exists(hashed_path):
+            shutil.copy2(path, hashed_path)
+        manifest[name] = hashed
+
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    return manifest
+
+
+def load_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_hashed(path, url):
+    """
+    `immutable_file_test` for WhiteNoise: content-hashed files never change.
+    """
+
+    return HASHED_NAME.search(url) is not None
+
+
+def accepted_encodings(accept_encoding):
+    accepted = set()
+
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+
+    return accepted
+
+
+class StaticFile:
+    __slots__ = ("path", "headers", "variants", "etags", "mtime", "_mmaps")
+
+    def __init__(self, path, url, stat, variants):
+        self.path = path
+        self.mtime = stat.st_mtime
+        self._mmaps = {}
+
+        content_type, _ = mimetypes.guess_type(path)
+        if HASHED_NAME.search(url):
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            cache_control = "max-age=60, public"
+        self.headers = [
+            ("Content-Type", content_type_header(content_type or DEFAULT_TYPE)),
+            ("Last-Modified", formatdate(stat.st_mtime, usegmt=True)),
+            ("Cache-Control", cache_control),
+        ]
+        if variants:
+            self.headers.append(("Vary", "Accept-Encoding"))
+
+        # encoding -> (path, size), identity last
+        self.variants = variants + [(None, path, stat.st_size)]
+
+        # every encoding is its own representation, so has its own ETag
+        etag = f"{int(stat.st_mtime):x}-{stat.st_size:x}"
+        self.etags = {None: f'"{etag}"'}
+        for encoding, _, _ in variants:
+            self.etags[encoding] = f'"{etag}-{encoding}"'
+
+    def matches(self, if_none_match, encoding):
+        # only a copy of the variant being served is current for this client
+        return etag_matches(if_none_match, self.etags[encoding])
+
+    def choose(self, accept_encoding):
+        if len(self.variants) > 1 and accept_encoding:
+            accepted = accepted_encodings(accept_encoding)
+            for encoding, path, size in self.variants:
+                if encoding is None or encoding in accepted:
+                    return encoding, path, size
+        return self.variants[-1]
+
+    def mapped(self, path):
+        # one read-only mapping per file, shared by every request
+        mapped = self._mmaps.get(path)
+        if mapped is None:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmaps[path] = mapped
+        return mapped
+
+
+class MmapBody:
+    """
+    # WSGI Iterable Over a Memory-Mapped File
+    """
+
+    def __init__(self, mapped, size, block_size=BLOCK_SIZE):
+        self.mapped = mapped
+        self.size = size
+        self.block_size = block_size
+
+    def __iter__(self):
+        for offset in range(0, self.size, self.block_size):
+            yield self.mapped[offset : offset + self.block_size]
+
+
+class StaticFiles:
+    """
+    # Static File Server
+
+    Indexes the files under `root` at start-up (optionally precompressing
+    them first) and serves the best encoding the client accepts, with
+    `ETag`/`304` handling. Files up to `max_cached_size` bytes are kept in
+    memory once requested, up to `cache_size` bytes in total. Files of at
+    least `mmap_threshold` bytes go to the server's `wsgi.file_wrapper` when
+    it has one, or are served from a shared memory map. Content-hashed names
+    are marked immutable for a year. Unknown paths fall through to
+    `application`.
+    """
+
+    def __init__(
+        self,
+        application,
+        root,
+        precompress=False,
+        max_cached_size=64 * 1024,
+        cache_size=32 * 1024 * 1024,
+        mmap_threshold=1024 * 1024,
+        autorefresh=False,
+    ):
+        self.application = application
+        self.root = os.path.realpath(root)
+        self.max_cached_size = max_cached_size
+        self.cache_size = cache_size
+        self.mmap_threshold = mmap_threshold
+        self.autorefresh = autorefresh
+
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+
+        if precompress and os.path.isdir(self.root):
+            compress_directory(self.root)
+
+        self.files = {}
+        if os.path.isdir(self.root):
+            for path in iter_files(self.root):
+                url = "/" + os.path.relpath(path, self.root).replace(os.sep, "/")
+                self.add(url, path)
+
+    def add(self, url, path):
+        if path.endswith(ENCODING_SUFFIXES) and os.path.exists(path[:-3]):
+            return None
+
+        variants = []
+        for encoding, suffix in ENCODINGS:
+            try:
+                size = os.path.getsize(path + suffix)
+            except OSError:
+                continue
+            variants.append((encoding, path + suffix, size))
+
+        static_file = StaticFile(path, url, os.stat(path), variants)
+        self.files[url] = static_file
+        return static_file
+
+    def find(self, url):
+        static_file = self.files.get(url)
+
+        if static_file is not None and self.autorefresh:
+            try:
+                changed = os.path.getmtime(static_file.path) != static_file.mtime
+            except OSError:
+                changed = True
+            if changed:
+                self.forget(url, static_file)
+                static_file = None
+
+        if static_file is None and self.autorefresh:
+            path = os.path.realpath(os.path.join(self.root, url.lstrip("/")))
+            if path.startswith(self.root + os.sep) and os.path.isfile(path):
+                static_file = self.add(url, path)
+
+        return static_file
+
+    def forget(self, url, static_file):
+        self.files.pop(url, None)
+        with self.lock:
+            for _, path, _ in static_file.variants:
+                data = self.cache.pop(path, None)
+                if data is not None:
+                    self.cached_bytes -= len(data)
+
+    def read_cached(self, path):
+        with self.lock:
+            data = self.cache.get(path)
+            if data is not None:
+                self.cache.move_to_end(path)
+                return data
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        with self.lock:
+            if path not in self.cache:
+                self.cache[path] = data
+                self.cached_bytes += len(data)
+                while self.cached_bytes > self.cache_size:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cached_bytes -= len(evicted)
+
+        return data
+
+    def __call__(self, environ, start_response):
+        static_file = self.find(environ.get("PATH_INFO", ""))
+        if static_file is None:
+            return self.application(environ, start_response)
+
+        method = environ["REQUEST_METHOD"]
+        if method not in ("GET", "HEAD"):
+            start_response(status_line(405), [("Allow", "GET, HEAD")])
+            return []
+
+        encoding, path, size = static_file.choose(
+            environ.get("HTTP_ACCEPT_ENCODING", "")
+        )
+        etag = ("ETag", static_file.etags[encoding])
+
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match and static_file.matches(if_none_match, encoding):
+            start_response(status_line(304), static_file.headers[1:] + [etag])
+            return []
+
+        headers = static_file.headers + [etag, ("Content-Length", str(size))]
+        if encoding is not None:
+            headers.append(("Content-Encoding", encoding))
+        start_response(status_line(200), headers)
+
+        if method == "HEAD":
+            return []
+
+        if size <= self.max_cached_size:
+            return [self.read_cached(path)]
+
+        # lets the server use sendfile() where it can
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if file_wrapper is not None:
+            return file_wrapper(open(path, "rb"), BLOCK_SIZE)
+
+        if size >= self.mmap_threshold:
+            return MmapBody(static_file.mapped(path), size)
+
+        return ClosingBlocks(open(path, "rb"))
+
+
+class ClosingBlocks:
+    def __init__(self, file):
+        self.file = file
+
+    def __iter__(self):
+        return read_blocks(self.file)
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,92 @@
+# templates.py
+import os
+
+from jinja2 import (
+    BytecodeCache,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+)
+
+
+class MemoryBytecodeCache(BytecodeCache):
+    """
+    # In-Process Bytecode Cache
+
+    Keeps compiled template bytecode in a dict. Filled before workers fork
+    (Gunicorn `--preload`), it spares every worker the compile step.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+
+    def load_bytecode(self, bucket):
+        data = self.buckets.get(bucket.key)
+        if data is not None:
+            bucket.bytecode_from_string(data)
+
+    def dump_bytecode(self, bucket):
+        self.buckets[bucket.key] = bucket.bytecode_to_string()
+
+    def clear(self):
+        self.buckets.clear()
+
+
+def make_bytecode_cache(template_cache):
+    if template_cache is None or isinstance(template_cache, BytecodeCache):
+        return template_cache
+
+    if template_cache == "memory":
+        return MemoryBytecodeCache()
+
+    os.makedirs(template_cache, exist_ok=True)
+    return FileSystemBytecodeCache(template_cache)
+
+
+def make_environment(templates_dir, template_cache=None, auto_reload=True):
+    return Environment(
+        loader=FileSystemLoader(os.path.abspath(templates_dir)),
+        bytecode_cache=make_bytecode_cache(template_cache),
+        auto_reload=auto_reload,
+        # keep every template once loaded, precompiled ones included
+        cache_size=-1,
+    )
+
+
+def precompile(templates_env):
+    """
+    Loads every template the environment can find, which compiles it, fills
+    the bytecode cache and keeps it in the environment's template cache.
+    Returns the names of the compiled templates.
+    """
+
+    names = templates_env.list_templates(
+        filter_func=lambda name: not os.path.basename(name).startswith(".")
+    )
+    for name in names:
+        templates_env.get_template(name)
+
+    return names
+
+
+def encode_stream(chunks, chunk_size=8192):
+    """
+    Encodes rendered text as UTF-8, yielding a chunk each time at least
+    `chunk_size` bytes are buffered.
+    """
+
+    buffer = []
+    buffered = 0
+
+    for text in chunks:
+        data = text.encode("UTF-8")
+        buffer.append(data)
+        buffered += len(data)
+
+        if buffered >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+
+    if buffer:
+        yield b"".join(buffer)
@@ -0,0 +1,228 @@
+# testing.py
+import io
+import json as jsonlib
+import sys
+import threading
+from http import HTTPStatus
+from http.cookies import SimpleCookie
+from urllib.parse import unquote_to_bytes, urlencode, urljoin, urlsplit
+
+from .request import Headers
+
+
+def make_environ(method="GET", path="/", headers=None, body=b"", query_string=""):
+    """
+    Builds a WSGI environ for calling an app directly, without a server.
+    `path` may be a full URL and may carry its own query string; it is
+    percent-decoded into `PATH_INFO`, as servers do.
+    """
+
+    url = urlsplit(path)
+    host = url.netloc or "testserver"
+    server_name, _, server_port = host.partition(":")
+    scheme = url.scheme or "http"
+
+    environ = {
+        "REQUEST_METHOD": method.upper(),
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote_to_bytes(url.path or "/").decode("latin-1"),
+        "QUERY_STRING": url.query or query_string,
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": server_port or ("443" if scheme == "https" else "80"),
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "REMOTE_ADDR": "127.0.0.1",
+        "HTTP_HOST": host,
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    if body:
+        environ["CONTENT_LENGTH"] = str(len(body))
+
+    for name, value in (headers or {}).items():
+        key = name.upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = f"HTTP_{key}"
+        environ[key] = value
+
+    return environ
+
+
+class HTTPError(Exception):
+    def __init__(self, message, response):
+        super().__init__(message)
+        self.response = response
+
+
+class TestResponse:
+    """
+    # Response Captured by the Test Client
+
+    Mirrors the parts of `requests.Response` that tests use: `status_code`,
+    case-insensitive `headers`, `content`, `text`, `json()`, `cookies`, `ok`
+    and `raise_for_status()`.
+    """
+
+    __test__ = False
+
+    def __init__(self, url, status, headers, content):
+        code, _, reason = status.partition(" ")
+        self.url = url
+        self.status_code = int(code)
+        self.reason = reason
+        self.content = content
+        self.header_list = headers
+
+        self.headers = Headers()
+        self.cookies = {}
+        for name, value in headers:
+            key = name.lower()
+            if key in self.headers:
+                # same folding as requests for repeated headers
+                self.headers[key] = f"{self.headers[key]}, {value}"
+            else:
+                self.headers[key] = value
+            if key == "set-cookie":
+                cookie = SimpleCookie()
+                cookie.load(value)
+                self.cookies.update((n, m.value) for n, m in cookie.items())
+
+    @property
+    def encoding(self):
+        content_type = self.headers.get("content-type", "")
+        for param in content_type.split(";")[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "charset":
+                return value.strip('"')
+        return "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return jsonlib.loads(self.content)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def raise_for_status(self):
+        if self.ok:
+            return
+        kind = "Client" if self.status_code < 500 else "Server"
+        raise HTTPError(
+            f"{self.status_code} {kind} Error: {self.reason} for url: {self.url}",
+            self,
+        )
+
+    def __repr__(self):
+        return f"<TestResponse [{self.status_code}]>"
+
+
+class TestClient:
+    """
+    # In-Process Test Client
+
+    Calls the WSGI app directly with environs built by `make_environ` and
+    collects the status, headers and body, with no HTTP adapter in between.
+    Its API follows `requests.Session`, so `client.get(url).text` and
+    friends keep working. URLs may be relative to `base_url`. Cookies set by
+    responses are sent with later requests.
+
+    A client holds no global state, so tests using their own clients can
+    run in parallel, from threads or separate processes.
+    """
+
+    __test__ = False
+
+    def __init__(self, app, base_url="http://testserver"):
+        self.app = app
+        self.base_url = base_url
+        self.cookies = {}
+        self.lock = threading.Lock()
+
+    def request(
+        self,
+        method,
+        url,
+        params=None,
+        data=None,
+        json=None,
+        headers=None,
+        cookies=None,
+    ):
+        url = urljoin(self.base_url + "/", url)
+        headers = dict(headers or {})
+        body = b""
+
+        if params:
+            separator = "&" if "?" in url else "?"
+            url = f"{url}{separator}{urlencode(params, doseq=True)}"
+
+        if json is not None:
+            body = jsonlib.dumps(json).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json")
+        elif isinstance(data, dict):
+            body = urlencode(data, doseq=True).encode("utf-8")
+            headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+        elif isinstance(data, str):
+            body = data.encode("utf-8")
+        elif data is not None:
+            body = bytes(data)
+
+        with self.lock:
+            sent_cookies = {**self.cookies, **(cookies or {})}
+        if sent_cookies and "Cookie" not in headers:
+            headers["Cookie"] = "; ".join(f"{n}={v}" for n, v in sent_cookies.items())
+
+        environ = make_environ(method, url, headers=headers, body=body)
+        captured = []
+
+        def start_response(status, response_headers, exc_info=None):
+            captured[:] = [status, response_headers]
+
+        result = self.app(environ, start_response)
+        try:
+            content = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+        status, response_headers = captured or [
+            f"{HTTPStatus.INTERNAL_SERVER_ERROR.value} Internal Server Error",
+            [],
+        ]
+        response = TestResponse(url, status, response_headers, content)
+
+        if response.cookies:
+            with self.lock:
+                self.cookies.update(response.cookies)
+
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def options(self, url, **kwargs):
+        return self.request("OPTIONS", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)